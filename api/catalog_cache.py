@@ -0,0 +1,265 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import streamlit as st
+import pandas as pd
+from api.shopify_api import get_shopify_api, compact_catalog
+from api.catalog_index import CatalogIndex
+from utils.metrics import metrics
+
+
+class CatalogCache:
+    """ Product catalog shared by every session and rerun in the process.
+    Readers always get the last good catalog without waiting; a background thread refreshes it
+    every ttl seconds, pulling only products updated since the last sync, and swaps the merged
+    frame in atomically. Each refresh is saved to a parquet snapshot that is loaded at startup,
+    so a restarted app serves the pickers straight away and revalidates in the background.
+
+    :param shopify_api: ShopifyAPI used to pull products
+    :param ttl: seconds between refreshes
+    :param snapshot_path: parquet file the catalog is saved to, None disables snapshots
+    :param full_refresh_interval: seconds between full refetches, which also drop deleted products
+
+    :ivar data: cached product frame, one row per variant
+    :ivar last_synced: updated_at_min watermark for the next incremental refresh
+    :ivar version: increases every time the cached frame changes
+    :ivar last_error: last background refresh error, cleared after a successful refresh
+    """
+    # overlap on the watermark to cover clock skew between us and Shopify
+    # products fetched twice are replaced by the merge, so overlap is harmless
+    WATERMARK_OVERLAP = timedelta(seconds=60)
+
+    def __init__(self, shopify_api, ttl=300, snapshot_path=None, full_refresh_interval=86400):
+        self.shopify_api = shopify_api
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.full_refresh_interval = full_refresh_interval
+        self.data = None
+        self.last_synced = None
+        self.version = 0
+        self.last_error = None
+        # monotonic times of the last fetch and full fetch, None until the first one
+        self._fetched_at = None
+        self._full_fetched_at = None
+        self._index = None
+        self._levels = {}
+        self._worker = None
+        # _lock guards the swap, _refresh_lock keeps a single fetch running at a time
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def is_stale(self):
+        """ Whether the catalog is older than the ttl
+        """
+        # never fetched, or only loaded from a snapshot, is stale whatever the host's uptime
+        return self._fetched_at is None or time.monotonic() - self._fetched_at >= self.ttl
+
+    def get(self):
+        """ Return the current catalog. Only blocks when there is neither a cached catalog nor a snapshot.
+        """
+        if self.data is None:
+            metrics.inc("cache_requests_total", cache="catalog", result="miss")
+            with self._refresh_lock:
+                if self.data is None and not self.load_snapshot():
+                    self._refresh(full=True)
+        elif self.is_stale():
+            metrics.inc("cache_requests_total", cache="catalog", result="stale")
+        else:
+            metrics.inc("cache_requests_total", cache="catalog", result="hit")
+        if self.is_stale():
+            # keep serving the stale catalog and let the worker revalidate it
+            self.start()
+            self._wake.set()
+        return self.data
+
+    def index(self):
+        """ CatalogIndex of the current catalog, rebuilt only when the catalog version changes
+        """
+        self.get()
+        with self._lock:
+            if self._index is None or self._index.version != self.version:
+                metrics.inc("cache_requests_total", cache="catalog_index", result="miss")
+                with metrics.span("catalog_index_build_seconds"):
+                    self._index = CatalogIndex(self.data, version=self.version)
+            else:
+                metrics.inc("cache_requests_total", cache="catalog_index", result="hit")
+            return self._index
+
+    def start(self):
+        """ Start the background refresher once per cache
+        """
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=0 if self._fetched_at is None
+                            else max(self.ttl - (time.monotonic() - self._fetched_at), 0))
+            self._wake.clear()
+            with self._refresh_lock:
+                # a reader may have loaded the catalog while we waited for the lock
+                if not self.is_stale():
+                    continue
+                try:
+                    self._refresh(full=self._full_fetched_at is None
+                                  or time.monotonic() - self._full_fetched_at >= self.full_refresh_interval)
+                except Exception as e:
+                    # keep serving the last good catalog and try again after another ttl
+                    self.last_error = repr(e)
+                    self._fetched_at = time.monotonic()
+                    metrics.inc("catalog_refresh_errors_total")
+                    print(f"catalog refresh failed: {e!r}")
+
+    def refresh(self, full=False):
+        """ Pull products from Shopify and swap the result in
+        :param full: refetch the whole catalog instead of only products changed since last sync
+        """
+        with self._refresh_lock:
+            self._refresh(full=full)
+
+    def _refresh(self, full=False):
+        started = datetime.now(timezone.utc)
+        metrics.inc("catalog_refreshes_total", kind="full" if full or self.data is None else "incremental")
+        if full or self.data is None:
+            data = self.shopify_api.get_product_list()
+            self._full_fetched_at = time.monotonic()
+        else:
+            watermark = (self.last_synced - self.WATERMARK_OVERLAP).isoformat(timespec="seconds")
+            updates = self.shopify_api.get_product_list(updated_at_min=watermark)
+            data = self.merge(self.data, updates) if not updates.empty else None
+        with self._lock:
+            if data is not None:
+                self.data = data
+                self.version += 1
+            self.last_synced = started
+            self._fetched_at = time.monotonic()
+        self.last_error = None
+        self.save_snapshot()
+
+    def update_inventory_level(self, inventory_item_id, location_id, available):
+        """ Apply an inventory_levels/update webhook to the cached catalog in place.
+        Shopify reports the level of one location, so the change against the last level seen for that
+        location is added to the variant's stock, which holds the total over all locations. The first level
+        seen for a location only becomes the baseline for later deltas, the catalog's total is left alone
+        until the next refresh brings it in.
+        Returns False when the item is not in the catalog.
+        :param inventory_item_id: inventory item of the variant
+        :param location_id: location the level belongs to
+        :param available: new available quantity at the location
+        """
+        with self._lock:
+            if self.data is None:
+                return False
+            previous = self._levels.get((inventory_item_id, location_id))
+            self._levels[(inventory_item_id, location_id)] = available
+            rows = self.data["child_inventory_item_id"] == inventory_item_id
+            if not rows.any():
+                return False
+            if previous is not None and available != previous:
+                quantity = int(self.data.loc[rows, "child_inventory_quantity"].iloc[0]) + available - previous
+                self._set_stock(rows, quantity)
+            return True
+
+    def apply_product(self, product):
+        """ Apply a products/update webhook to the cached catalog.
+        When only stock changed the quantities are updated in place, otherwise the product's rows are
+        replaced and the catalog version moves on.
+        :param product: product dict from the webhook payload
+        """
+        updates = self.shopify_api.parse_page([product])
+        if self.shopify_api.lean:
+            updates = compact_catalog(updates)
+        with self._lock:
+            if self.data is None:
+                return
+            current = self.data[self.data["parent_id"] == product["id"]]
+            same_variants = (sorted(zip(current["child_id"], current["child_sku"].astype(str))) ==
+                             sorted(zip(updates["child_id"], updates["child_sku"].astype(str))))
+            same_product = all((current[column].astype(str) == str(product[field])).all()
+                               for column, field in (("parent_title", "title"), ("parent_status", "status"),
+                                                     ("parent_tags", "tags")))
+            if same_variants and same_product:
+                for child_id, quantity in zip(updates["child_id"], updates["child_inventory_quantity"]):
+                    self._set_stock(self.data["child_id"] == child_id, int(quantity))
+                return
+            self.data = self.merge(self.data, updates)
+            self.version += 1
+
+    def _set_stock(self, rows, quantity):
+        # frame and current index are updated together, the index is not rebuilt for a stock change
+        self.data.loc[rows, "child_inventory_quantity"] = quantity
+        if self._index is not None and self._index.version == self.version:
+            for sku in self.data.loc[rows, "child_sku"]:
+                if sku in self._index.stock_by_sku:
+                    self._index.stock_by_sku[sku] = quantity
+
+    def merge(self, data, updates):
+        """ Replace every variant of the updated products with their fresh rows
+        :param data: current product frame
+        :param updates: product frame holding only the changed products
+        """
+        changed = updates["parent_id"].unique()
+        kept = data[~data["parent_id"].isin(changed)]
+        merged = pd.concat([kept, updates], ignore_index=True)
+        # categoricals with different categories concat to object, restore compact dtypes
+        if self.shopify_api.lean:
+            merged = compact_catalog(merged)
+        return merged
+
+    def save_snapshot(self):
+        """ Write the catalog and its sync watermark to disk
+        """
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            data, last_synced = self.data, self.last_synced
+        # write next to the snapshot and rename, so a crash never leaves half a file
+        data.to_parquet(self.snapshot_path + ".tmp", index=False)
+        with open(self.snapshot_path + ".json.tmp", "w") as file:
+            json.dump({"last_synced": last_synced.isoformat()}, file)
+        os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
+        os.replace(self.snapshot_path + ".json.tmp", self.snapshot_path + ".json")
+
+    def load_snapshot(self):
+        """ Load the catalog saved by an earlier process. Returns False when there is no usable snapshot.
+        The loaded catalog counts as stale, so the worker revalidates it from its watermark right away.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path + ".json"):
+            return False
+        try:
+            data = pd.read_parquet(self.snapshot_path)
+            with open(self.snapshot_path + ".json") as file:
+                last_synced = datetime.fromisoformat(json.load(file)["last_synced"])
+        except Exception as e:
+            print(f"ignoring unreadable catalog snapshot: {e!r}")
+            return False
+        with self._lock:
+            self.data = data
+            self.last_synced = last_synced
+            self.version += 1
+            self._fetched_at = None
+        # the snapshot is the base for incremental refreshes until the next scheduled full refetch
+        self._full_fetched_at = time.monotonic()
+        return True
+
+
+@st.cache_resource
+def get_catalog_cache(ttl=300, catalog_source="rest", snapshot_path=None, lean=True, concurrency=1):
+    """ Process-wide CatalogCache with its background refresher running
+    :param ttl: seconds between refreshes
+    :param catalog_source: 'rest' or 'bulk', see ShopifyAPI
+    :param snapshot_path: parquet file the catalog is saved to and warm-started from
+    :param lean: only fetch and keep the catalog fields the order app uses
+    :param concurrency: catalog partitions fetched in parallel on a full load
+    """
+    shopify_api = get_shopify_api(catalog_source=catalog_source, lean=lean, concurrency=concurrency)
+    cache = CatalogCache(shopify_api, ttl=ttl, snapshot_path=snapshot_path)
+    # warm start from disk before the worker decides between a full and an incremental fetch
+    cache.load_snapshot()
+    cache.start()
+    return cache
@@ -0,0 +1,65 @@
+import sys
+
+
+class CatalogIndex:
+    """ Lookup tables over one version of the product catalog for the order form.
+    Built once per catalog version so the pickers never scan the catalog frame on a rerun.
+    Strings are interned so titles and SKUs repeated across tables are stored once.
+
+    :param data: catalog frame, one row per variant as returned by ShopifyAPI
+    :param version: catalog version the index was built from
+
+    :ivar version: catalog version the index was built from
+    :ivar skus_by_product: product title -> SKUs of its active variants
+    :ivar stock_by_sku: SKU -> inventory quantity
+    :ivar titles: every active product title
+    :ivar marketing_titles: active product titles tagged Marketing
+    """
+    # departments limited to products tagged for marketing
+    MARKETING_DEPARTMENTS = ("Marketing", "Sales")
+
+    def __init__(self, data, version=0):
+        self.version = version
+        self.skus_by_product = {}
+        self.stock_by_sku = {}
+        titles = set()
+        marketing_titles = set()
+
+        active = data[data["parent_status"] == "active"]
+        for sku, title, stock, tags in zip(active["child_sku"], active["parent_title"],
+                                           active["child_inventory_quantity"], active["parent_tags"]):
+            title = sys.intern(title)
+            titles.add(title)
+            if isinstance(tags, str) and "Marketing" in tags:
+                marketing_titles.add(title)
+            skus = self.skus_by_product.setdefault(title, [])
+            # variants without a sku cannot be shipped by the warehouse
+            if not isinstance(sku, str) or not sku:
+                continue
+            sku = sys.intern(sku)
+            skus.append(sku)
+            self.stock_by_sku[sku] = int(stock) if stock == stock else 0
+
+        self.skus_by_product = {title: tuple(skus) for title, skus in self.skus_by_product.items()}
+        self.titles = tuple(sorted(titles))
+        self.marketing_titles = tuple(sorted(marketing_titles))
+
+    def titles_for(self, department):
+        """ Product titles the department is allowed to order
+        :param department: ordering department
+        """
+        if department in self.MARKETING_DEPARTMENTS:
+            return self.marketing_titles
+        return self.titles
+
+    def skus_for(self, product):
+        """ SKUs of a product, empty when no product is selected
+        :param product: product title
+        """
+        return self.skus_by_product.get(product, ())
+
+    def stock(self, sku):
+        """ Inventory quantity of a SKU, 0 when unknown
+        :param sku: variant sku
+        """
+        return self.stock_by_sku.get(sku, 0)
@@ -1,11 +1,25 @@
+import threading
+import time
+from collections import deque
 import streamlit as st
+import pandas as pd
 from streamlit_gsheets import GSheetsConnection
+from gspread.utils import rowcol_to_a1
+from utils.metrics import metrics
 
 class GoogleSheets:
     """ Connecting Google Sheets API with Streamlit
+    :param conn: gsheets connection to use instead of the one configured in st.secrets
+
+    :ivar conn: streamlit gsheets connection
+    :ivar append_latencies: seconds taken by the most recent append calls
     """
-    def __init__(self):
-        self.conn = self.create_connection()
+    def __init__(self, conn=None):
+        self.conn = conn or self.create_connection()
+        self.append_latencies = deque(maxlen=100)
+        self._worksheets = {}
+        self._columns = {}
+        self._lock = threading.Lock()
         
     def create_connection(self):
         """ Create connection with Google Sheets
@@ -13,17 +27,101 @@ class GoogleSheets:
         conn = st.connection("gsheets", type=GSheetsConnection)
         return conn
     
-    def read_existing_data(self, worksheet="Sheet1"):
+    def read_existing_data(self, worksheet="Sheet1", ttl=3600):
         """ Pull existing data on Google Sheet
         :param worksheet: specify worksheet to read
+        :param ttl: seconds the connection may serve a cached copy, 0 forces a fresh read
         """
-        existing_data = self.conn.read(worksheet=worksheet)
+        with metrics.span("sheets_request_seconds", call="read"):
+            existing_data = self.conn.read(worksheet=worksheet, ttl=ttl)
         existing_data = existing_data.dropna(how="all")
         return existing_data
     
     def update_data(self, worksheet, data):
-        """ Push new data onto Google Sheet
+        """ Overwrite the whole worksheet with data.
+        Only meant for repairing the sheet, new orders go through append_rows.
         :param worksheet: specify worksheet to update
-        :param data: new data to add to worksheet
+        :param data: full worksheet contents
+        """
+        with metrics.span("sheets_request_seconds", call="update"):
+            self.conn.update(worksheet=worksheet, data=data)
+        # rows may have moved, incremental column reads start over
+        with self._lock:
+            for key in [key for key in self._columns if key[0] == worksheet]:
+                del self._columns[key]
+
+    def open_worksheet(self, worksheet="Sheet1"):
+        """ Open the gspread worksheet behind the connection, once per worksheet
+        :param worksheet: specify worksheet to open
+        """
+        # the gsheets connection only exposes whole-sheet reads and writes,
+        # the gspread worksheet underneath supports appends and ranged reads
+        if worksheet not in self._worksheets:
+            self._worksheets[worksheet] = self.conn.client._select_worksheet(worksheet=worksheet)
+        return self._worksheets[worksheet]
+
+    def read_column(self, worksheet, column):
+        """ Values of one column, fetched incrementally.
+        The first call reads the whole column; later calls only fetch rows appended after the
+        last row already read, using the cached row count as watermark.
+        :param worksheet: specify worksheet to read
+        :param column: header of the column to read
+        """
+        with self._lock:
+            sheet = self.open_worksheet(worksheet)
+            cached = self._columns.get((worksheet, column))
+            if cached is None:
+                metrics.inc("cache_requests_total", cache="sheet_column", result="miss")
+                with metrics.span("sheets_request_seconds", call="row_values"):
+                    col = sheet.row_values(1).index(column) + 1
+                with metrics.span("sheets_request_seconds", call="col_values"):
+                    values = sheet.col_values(col)[1:]
+                cached = self._columns[(worksheet, column)] = {"col": col, "values": values, "rows": len(values) + 1}
+            else:
+                metrics.inc("cache_requests_total", cache="sheet_column", result="hit")
+                start = rowcol_to_a1(cached["rows"] + 1, cached["col"])
+                letter = start.rstrip("0123456789")
+                # empty cells come back as empty rows
+                with metrics.span("sheets_request_seconds", call="get"):
+                    new_rows = sheet.get(f"{start}:{letter}")
+                cached["values"].extend(row[0] if row else "" for row in new_rows)
+                cached["rows"] += len(new_rows)
+            return [value for value in cached["values"] if value != ""]
+
+    def read_order_numbers(self, worksheet="Sheet1"):
+        """ Sales order numbers already on the sheet, read incrementally
+        :param worksheet: specify worksheet to read
         """
-        self.conn.update(worksheet=worksheet, data=data)
\ No newline at end of file
+        return self.read_column(worksheet, "Sales order number *")
+
+    def append_rows(self, worksheet, data):
+        """ Append rows below the last filled row in one batched call.
+        Only the new rows are sent and concurrent appends never overwrite each other.
+        :param worksheet: specify worksheet to append to
+        :param data: dataframe of new rows in the worksheet's column order
+        """
+        if data.empty:
+            return
+        rows = sheet_rows(data)
+        start = time.perf_counter()
+        self.open_worksheet(worksheet).append_rows(rows, value_input_option="USER_ENTERED")
+        latency = time.perf_counter() - start
+        self.append_latencies.append(latency)
+        metrics.observe("sheets_request_seconds", latency, call="append_rows")
+        metrics.inc("sheets_rows_appended_total", len(rows))
+        print(f"appended {len(rows)} rows to {worksheet} in {latency:.2f}s")
+
+
+def sheet_rows(data):
+    """ Rows of a dataframe as lists of plain python values with missing cells left blank.
+    One object array conversion is much cheaper than masking an object copy of the frame for the few rows of an order.
+    :param data: dataframe in the worksheet's column order
+    """
+    return [["" if pd.isna(value) else value for value in row] for row in data.to_numpy(dtype=object).tolist()]
+
+
+@st.cache_resource
+def get_google_sheets():
+    """ Process-wide GoogleSheets shared by every session and rerun
+    """
+    return GoogleSheets()
@@ -0,0 +1,77 @@
+import threading
+import time
+
+
+class LeakyBucket:
+    """ Client-side model of Shopify's leaky bucket rate limit.
+    Every request takes a slot from the bucket and slots drain at a fixed rate. Requests wait
+    only as long as needed to stay just under the limit, so sustained throughput sits at the
+    leak rate instead of bursting into 429s. Safe to share between threads.
+
+    :param capacity: bucket size, corrected from the X-Shopify-Shop-Api-Call-Limit header
+    :param leak_rate: slots drained per second
+    :param headroom: slots kept free for other clients of the same store
+
+    :ivar capacity: bucket size
+    :ivar leak_rate: slots drained per second
+    """
+    # shopify drains a full bucket in 20 seconds on every plan (40/2, 80/4, 400/20)
+    DRAIN_SECONDS = 20
+
+    def __init__(self, capacity=40, leak_rate=2.0, headroom=2):
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.headroom = headroom
+        self._level = 0.0
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _drain(self, now):
+        self._level = max(0.0, self._level - (now - self._updated) * self.leak_rate)
+        self._updated = now
+
+    def acquire(self):
+        """ Block until a request fits in the bucket and reserve a slot for it.
+        Returns the seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._drain(now)
+                limit = max(self.capacity - self.headroom, 1)
+                if now >= self._blocked_until and self._level + 1 <= limit:
+                    self._level += 1
+                    return waited
+                wait = max(self._blocked_until - now,
+                           (self._level + 1 - limit) / self.leak_rate)
+            time.sleep(wait)
+            waited += wait
+
+    def update(self, header):
+        """ Sync the bucket with the level Shopify reports
+        :param header: value of X-Shopify-Shop-Api-Call-Limit, e.g. '32/40'
+        """
+        used, capacity = (int(n) for n in header.split("/"))
+        with self._lock:
+            self._drain(time.monotonic())
+            if capacity != self.capacity:
+                self.capacity = capacity
+                self.leak_rate = capacity / self.DRAIN_SECONDS
+            # local level includes requests still in flight, keep whichever is higher
+            self._level = max(self._level, float(used))
+
+    def penalize(self, retry_after):
+        """ Hold every caller back after Shopify throttled a request
+        :param retry_after: seconds to wait before the next request
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._drain(now)
+            self._level = float(self.capacity)
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+
+
+# one bucket per process, the limit belongs to the store and not to a session
+shopify_rate_limiter = LeakyBucket()
@@ -1,20 +1,61 @@
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import time
 import streamlit as st
 import pandas as pd
 import json
+from api.rate_limiter import shopify_rate_limiter
+from utils.metrics import metrics
+
+# product fields the order app reads, rest has no projection inside variants so they come back whole
+CATALOG_FIELDS = "id,title,status,tags,variants"
+
+# columns of the lean catalog frame
+CATALOG_COLUMNS = ["child_id", "child_sku", "child_inventory_quantity", "child_inventory_item_id",
+                   "parent_id", "parent_title", "parent_status", "parent_tags"]
 
 class ShopifyAPI:
     """ Initiate Shopify API
     :param base_url: shopify url for api connection
     :param endpoint: endpoint address to fetch product data with a maximum count of 250
+    :param rate_limiter: leaky bucket shared by every request to the store
+    :param max_retries: how many times a throttled request is retried
+    :param catalog_source: 'rest' pages products.json, 'bulk' runs a GraphQL bulk operation
+    :param graphql_endpoint: endpoint address of the admin GraphQL api
+    :param access_token: admin api token, read from st.secrets when not given
+    :param pool_maxsize: most keep-alive connections held open to the store
+    :param lean: only request and keep the catalog fields the order app uses
+    :param concurrency: how many created_at partitions of the catalog are fetched at the same time
     
     :ivar base_url: url address for shopify
     :ivar endpoint: additional address for products json
+    :ivar rate_limiter: paces requests to stay under shopify's call limit
+    :ivar catalog_source: where get_product_list pulls the catalog from
+    :ivar lean: whether the catalog is fetched field-projected with compact dtypes
+    :ivar parse_stats: parse time and frame memory of the last get_product_list call
+    :ivar concurrency: partitions fetched in parallel on a full catalog load
     """
-    def __init__(self, base_url="https://peachandlily2.myshopify.com", endpoint="/admin/api/2024-01/products.json?limit=250"):
+    # bulk operation polling interval and give-up time in seconds
+    BULK_POLL_INTERVAL = 2
+    BULK_TIMEOUT = 1800
+
+    def __init__(self, base_url="https://peachandlily2.myshopify.com", endpoint="/admin/api/2024-01/products.json?limit=250",
+                 rate_limiter=shopify_rate_limiter, max_retries=5, catalog_source="rest",
+                 graphql_endpoint="/admin/api/2024-01/graphql.json", access_token=None, pool_maxsize=10,
+                 lean=True, concurrency=1):
        self.base_url = base_url
        self.endpoint = endpoint
+       self.rate_limiter = rate_limiter
+       self.max_retries = max_retries
+       self.catalog_source = catalog_source
+       self.graphql_endpoint = graphql_endpoint
+       self.access_token = access_token
+       self.pool_maxsize = pool_maxsize
+       self.lean = lean
+       self.concurrency = concurrency
+       self.parse_stats = {}
        self.session = self.create_session()
        
     
@@ -22,12 +63,17 @@ class ShopifyAPI:
         s = requests.Session()
         s.headers.update({
             "Content-Type": "application/json",
-            "X-Shopify-Access-Token": st.secrets["shopify_token"]
+            "X-Shopify-Access-Token": self.access_token or st.secrets["shopify_token"]
             })
         # important tokens and credentials are in streamlit's secret section
         # st.secrets allow streamlit to read what's in the secrets area
         # This was to prevent access for people who look at github
         
+        # keep-alive pool so TCP/TLS setup is reused across requests and reruns
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.pool_maxsize, self.concurrency))
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+
         # Everytime we get response from url, api_call will run
         s.hooks["response"] = self.api_calls
         
@@ -35,15 +81,40 @@ class ShopifyAPI:
     
     # function to call shopify call limit
     def api_calls(self, r, *args, **kwargs):
-        """ Call Shopify's call limit and maintain below limit
+        """ Feed Shopify's reported call limit into the shared rate limiter
         :param r: reads the response when session is created
         """
-        # checks the how many calls are left
-        calls_left = r.headers['X-Shopify-Shop-Api-Call-Limit'].split("/")
-        # call limit is 400. if 399 goes to sleep.
-        if (int(calls_left[0])) == 398:
-            print('limit close, sleeping')
-            time.sleep(5)
+        # checks the how many calls are used, e.g. '32/40'
+        call_limit = r.headers.get('X-Shopify-Shop-Api-Call-Limit')
+        if call_limit:
+            self.rate_limiter.update(call_limit)
+
+    def request(self, sess, url, params=None):
+        """ GET through the rate limiter, retrying throttled and transient server errors
+        :param sess: requests session to send with
+        :param url: full url to fetch
+        :param params: query parameters
+        """
+        for attempt in range(self.max_retries + 1):
+            metrics.observe("shopify_rate_limit_wait_seconds", self.rate_limiter.acquire())
+            with metrics.span("shopify_request_seconds", api="rest"):
+                resp = sess.get(url, params=params)
+            metrics.inc("shopify_responses_total", api="rest", status=resp.status_code)
+            if resp.status_code != 429 and resp.status_code < 500:
+                break
+            if attempt == self.max_retries:
+                break
+            # shopify tells us how long to back off on 429, otherwise back off exponentially
+            retry_after = resp.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after else min(2 ** attempt, 30)
+            print(f"shopify returned {resp.status_code}, retrying in {delay}s")
+            metrics.inc("shopify_retries_total", status=resp.status_code)
+            if resp.status_code == 429:
+                self.rate_limiter.penalize(delay)
+            else:
+                time.sleep(delay)
+        resp.raise_for_status()
+        return resp
     
     # Parse JSON
     def parse_json(self, resp):
@@ -51,7 +122,13 @@ class ShopifyAPI:
         :params resp: response from get of baseurl and endpoint
         """
         products = resp.json()
-        product_list = pd.json_normalize(products['products'],
+        return self.parse_products(products['products'])
+
+    def parse_products(self, products):
+        """ flatten product dicts to one row per variant
+        :param products: list of product dicts from shopify api
+        """
+        product_list = pd.json_normalize(products,
                                         sep="_",
                                         record_path = ['variants'],
                                         meta=['id', 'title', 'status', 'tags'],
@@ -59,34 +136,290 @@ class ShopifyAPI:
                                         record_prefix = "child_")
         return product_list
 
+    def parse_products_lean(self, products):
+        """ build one row per variant straight from the few fields the order app uses
+        :param products: list of product dicts from shopify api
+        """
+        columns = {name: [] for name in CATALOG_COLUMNS}
+        for product in products:
+            for variant in product["variants"]:
+                columns["child_id"].append(variant["id"])
+                columns["child_sku"].append(variant.get("sku"))
+                columns["child_inventory_quantity"].append(variant.get("inventory_quantity") or 0)
+                columns["child_inventory_item_id"].append(variant.get("inventory_item_id"))
+                columns["parent_id"].append(product["id"])
+                columns["parent_title"].append(product["title"])
+                columns["parent_status"].append(product["status"])
+                columns["parent_tags"].append(product["tags"])
+        return pd.DataFrame(columns, columns=CATALOG_COLUMNS)
+
+    def parse_page(self, products):
+        """ parse one page of products with the configured parser
+        :param products: list of product dicts from shopify api
+        """
+        return self.parse_products_lean(products) if self.lean else self.parse_products(products)
+
     def link_pages(self, resp):
         """ function to link pages from url. 
         link to next url using requests's links method to the header of session.
         :param resp: parse response from Shopify API
         """
         #link to next url using requests's links method to the header of session.
-        next_url = resp.links['next']['url']
+        # last page has no next link
+        next_url = resp.links.get('next', {}).get('url')
         return next_url
-    
-    def get_product_list(self):
-        sess = self.create_session()
-        resp = sess.get(self.base_url + self.endpoint)
-        
-        product_list = self.parse_json(resp)
-        next_url = self.link_pages(resp)
-        
+
+    def iter_pages(self, updated_at_min=None, raw=False, filters=None):
+        """ Walk product pages one at a time following the Link header
+        :param updated_at_min: only fetch products updated at or after this ISO timestamp
+        :param raw: yield the list of product dicts of each page instead of a parsed frame
+        :param filters: extra products.json filters for the first page, e.g. created_at_min
+        """
+        sess = self.session
+        fields = {"fields": CATALOG_FIELDS} if self.lean else {}
+        params = dict(fields, **(filters or {}))
+        if updated_at_min:
+            params["updated_at_min"] = updated_at_min
+        next_url = self.base_url + self.endpoint
         while next_url:
-            print("start")
-            new_response = sess.get(next_url)
-            new_parse = self.parse_json(new_response)
-            product_list = pd.concat([product_list, new_parse], ignore_index=True)
-            try:
-                next_url = self.link_pages(new_response)
-            except:
-                break
-            else:
-                next_url = self.link_pages(new_response)
-        print("finish")
-        
-        print(product_list)
-        return product_list
\ No newline at end of file
+            resp = self.request(sess, next_url, params=params or None)
+            products = resp.json()['products']
+            yield products if raw else self.parse_page(products)
+            # page_info urls already carry the query, shopify only accepts limit and fields next to them
+            next_url = self.link_pages(resp)
+            params = fields if next_url and "fields=" not in next_url else None
+
+    def iter_products(self, updated_at_min=None):
+        """ Stream raw product dicts across every page
+        :param updated_at_min: only fetch products updated at or after this ISO timestamp
+        """
+        for products in self.iter_pages(updated_at_min=updated_at_min, raw=True):
+            yield from products
+
+    def get_product_list(self, updated_at_min=None):
+        """ Fetch every product page from Shopify into a single frame
+        :param updated_at_min: only fetch products updated at or after this ISO timestamp
+        """
+        if self.catalog_source == "bulk":
+            return self.get_product_list_bulk(updated_at_min=updated_at_min)
+        # incremental refreshes are a page or two, only full loads are worth partitioning
+        if self.concurrency > 1 and not updated_at_min:
+            return self.get_product_list_concurrent()
+        pages, parse_seconds = self.fetch_pages(updated_at_min=updated_at_min)
+        product_list = pd.concat(pages, ignore_index=True)
+        if self.lean:
+            product_list = compact_catalog(product_list)
+        self.record_parse_stats(product_list, parse_seconds)
+        print(f"fetched {len(product_list)} variants over {len(pages)} pages")
+        return product_list
+
+    def fetch_pages(self, updated_at_min=None, filters=None):
+        """ Fetch and parse every page of one product listing.
+        Returns the parsed pages and the time spent parsing them.
+        :param updated_at_min: only fetch products updated at or after this ISO timestamp
+        :param filters: extra products.json filters for the first page
+        """
+        # pages are kept in a list and joined once so load time grows linearly with catalog size
+        pages = []
+        parse_seconds = 0.0
+        for products in self.iter_pages(updated_at_min=updated_at_min, raw=True, filters=filters):
+            start = time.perf_counter()
+            pages.append(self.parse_page(products))
+            parse_seconds += time.perf_counter() - start
+        return pages, parse_seconds
+
+    def partition_filters(self, partitions):
+        """ Split the catalog into disjoint created_at ranges, from the oldest product until now
+        :param partitions: number of ranges
+        """
+        # since_id walks products in id order, so the first one is the oldest
+        resp = self.request(self.session, self.base_url + self.endpoint.split("?")[0],
+                            params={"limit": 1, "since_id": 0, "fields": "id,created_at"})
+        products = resp.json()["products"]
+        if not products:
+            return [{}]
+        oldest = datetime.fromisoformat(products[0]["created_at"]).astimezone(timezone.utc)
+        # products created while fetching land in the last range
+        newest = datetime.now(timezone.utc) + timedelta(days=1)
+        step = (newest - oldest) / partitions
+        bounds = [oldest - timedelta(seconds=1) + step * i for i in range(partitions)] + [newest]
+        return [{"created_at_min": lower.isoformat(timespec="seconds"),
+                 "created_at_max": upper.isoformat(timespec="seconds")}
+                for lower, upper in zip(bounds, bounds[1:])]
+
+    def get_product_list_concurrent(self):
+        """ Fetch created_at partitions of the catalog in parallel and merge them.
+        All threads draw from the shared rate limiter, so concurrency only fills unused budget.
+        """
+        start = time.perf_counter()
+        filters = self.partition_filters(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="catalog-partition") as pool:
+            results = list(pool.map(lambda partition: self.fetch_pages(filters=partition), filters))
+        pages = [page for partition_pages, _ in results for page in partition_pages]
+        # an empty range parses to a frame without dtypes, which would turn every sku column into object
+        product_list = pd.concat([page for page in pages if len(page)] or pages, ignore_index=True)
+        # range edges are inclusive on both sides, a product on a boundary comes back twice
+        product_list = product_list.drop_duplicates(subset="child_id", ignore_index=True)
+        if self.lean:
+            product_list = compact_catalog(product_list)
+        self.record_parse_stats(product_list, sum(seconds for _, seconds in results))
+        print(f"fetched {len(product_list)} variants over {len(pages)} pages in {len(filters)} partitions "
+              f"in {time.perf_counter() - start:.2f}s")
+        return product_list
+
+    def record_parse_stats(self, product_list, parse_seconds):
+        """ Keep parse time and frame memory so lean and full parsing can be compared
+        :param product_list: parsed catalog frame
+        :param parse_seconds: time spent parsing
+        """
+        self.parse_stats = {
+            "mode": "lean" if self.lean else "full",
+            "rows": len(product_list),
+            "columns": len(product_list.columns),
+            "parse_seconds": parse_seconds,
+            "memory_bytes": int(product_list.memory_usage(deep=True).sum()),
+        }
+        print(f"catalog parse stats: {self.parse_stats}")
+        metrics.observe("catalog_parse_seconds", parse_seconds, mode=self.parse_stats["mode"])
+        metrics.set("catalog_frame_bytes", self.parse_stats["memory_bytes"])
+
+
+    # GraphQL Bulk Operations
+    def graphql(self, sess, query):
+        """ Send a query to the admin GraphQL api and return its data
+        :param sess: requests session to send with
+        :param query: GraphQL query or mutation
+        """
+        with metrics.span("shopify_request_seconds", api="graphql"):
+            resp = sess.post(self.base_url + self.graphql_endpoint, json={"query": query})
+        metrics.inc("shopify_responses_total", api="graphql", status=resp.status_code)
+        resp.raise_for_status()
+        body = resp.json()
+        if body.get("errors"):
+            raise RuntimeError(f"shopify graphql error: {body['errors']}")
+        return body["data"]
+
+    def start_bulk_operation(self, sess, updated_at_min=None):
+        """ Start a bulk operation exporting every product with its variants
+        :param sess: requests session to send with
+        :param updated_at_min: only export products updated at or after this ISO timestamp
+        """
+        search = f'(query: "updated_at:>=\'{updated_at_min}\'")' if updated_at_min else ""
+        query = """
+        mutation {
+          bulkOperationRunQuery(query: \"\"\"
+            {
+              products%s {
+                edges { node {
+                  id title status tags
+                  variants { edges { node { id sku inventoryQuantity inventoryItem { id } } } }
+                } }
+              }
+            }
+          \"\"\") {
+            bulkOperation { id status }
+            userErrors { field message }
+          }
+        }
+        """ % search
+        result = self.graphql(sess, query)["bulkOperationRunQuery"]
+        if result["userErrors"]:
+            raise RuntimeError(f"bulk operation rejected: {result['userErrors']}")
+        return result["bulkOperation"]["id"]
+
+    def wait_bulk_operation(self, sess):
+        """ Poll the running bulk operation until it finishes and return its result url
+        :param sess: requests session to send with
+        """
+        query = "{ currentBulkOperation { id status errorCode objectCount url } }"
+        deadline = time.monotonic() + self.BULK_TIMEOUT
+        while time.monotonic() < deadline:
+            operation = self.graphql(sess, query)["currentBulkOperation"]
+            if operation["status"] == "COMPLETED":
+                # url is empty when the query matched nothing
+                return operation["url"]
+            if operation["status"] in ("FAILED", "CANCELED", "EXPIRED"):
+                raise RuntimeError(f"bulk operation {operation['status'].lower()}: {operation['errorCode']}")
+            time.sleep(self.BULK_POLL_INTERVAL)
+        raise TimeoutError("bulk operation did not finish in time")
+
+    def parse_bulk_lines(self, lines):
+        """ Rebuild one row per variant from bulk operation JSONL.
+        Products come before their variants and variants point back with __parentId,
+        so only product fields are held while streaming.
+        :param lines: iterable of JSONL lines
+        """
+        parents = {}
+        columns = {name: [] for name in CATALOG_COLUMNS}
+        for line in lines:
+            if not line:
+                continue
+            node = json.loads(line)
+            parent_gid = node.get("__parentId")
+            if parent_gid is None:
+                # product line, tags come as a list in graphql and a comma separated string in rest
+                parents[node["id"]] = (gid_to_id(node["id"]), node["title"], node["status"].lower(), ", ".join(node["tags"]))
+                continue
+            parent_id, title, status, tags = parents[parent_gid]
+            inventory_item = node.get("inventoryItem") or {}
+            columns["child_id"].append(gid_to_id(node["id"]))
+            columns["child_sku"].append(node["sku"])
+            # inventoryQuantity is null for untracked variants
+            columns["child_inventory_quantity"].append(node.get("inventoryQuantity") or 0)
+            columns["child_inventory_item_id"].append(gid_to_id(inventory_item["id"]) if inventory_item else None)
+            columns["parent_id"].append(parent_id)
+            columns["parent_title"].append(title)
+            columns["parent_status"].append(status)
+            columns["parent_tags"].append(tags)
+        return compact_catalog(pd.DataFrame(columns, columns=CATALOG_COLUMNS))
+
+    def get_product_list_bulk(self, updated_at_min=None):
+        """ Fetch the catalog with a GraphQL bulk operation and stream its JSONL result
+        :param updated_at_min: only fetch products updated at or after this ISO timestamp
+        """
+        sess = self.session
+        self.start_bulk_operation(sess, updated_at_min=updated_at_min)
+        url = self.wait_bulk_operation(sess)
+        if not url:
+            return self.parse_bulk_lines([])
+        # result url is a signed storage link, shopify's token must not be sent there
+        start = time.perf_counter()
+        with metrics.span("shopify_request_seconds", api="bulk_result"), requests.get(url, stream=True) as resp:
+            resp.raise_for_status()
+            product_list = self.parse_bulk_lines(resp.iter_lines(decode_unicode=True))
+        self.record_parse_stats(product_list, time.perf_counter() - start)
+        print(f"fetched {len(product_list)} variants with bulk operation")
+        return product_list
+
+
+@st.cache_resource
+def get_shopify_api(catalog_source="rest", lean=True, concurrency=1):
+    """ Process-wide ShopifyAPI so its pooled session is shared by every session and rerun
+    :param catalog_source: 'rest' or 'bulk', see ShopifyAPI
+    :param lean: only fetch and keep the catalog fields the order app uses
+    :param concurrency: catalog partitions fetched in parallel on a full load
+    """
+    return ShopifyAPI(catalog_source=catalog_source, lean=lean, concurrency=concurrency)
+
+
+def compact_catalog(product_list):
+    """ Store a lean catalog frame with compact dtypes.
+    Titles, statuses and tags repeat for every variant of a product, so they become categoricals.
+    :param product_list: frame with CATALOG_COLUMNS
+    """
+    return product_list.astype({
+        "child_id": "int64",
+        "child_inventory_quantity": "int32",
+        "child_inventory_item_id": "Int64",
+        "parent_id": "int64",
+        "parent_title": "category",
+        "parent_status": "category",
+        "parent_tags": "category",
+    })
+
+
+def gid_to_id(gid):
+    """ Turn a GraphQL global id such as gid://shopify/Product/123 into the numeric rest id
+    :param gid: GraphQL global id
+    """
+    return int(gid.rsplit("/", 1)[1])
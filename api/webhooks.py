@@ -0,0 +1,107 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import streamlit as st
+from utils.metrics import metrics
+
+
+class WebhookReceiver:
+    """ Local receiver for Shopify inventory and product webhooks.
+    Verified inventory_levels/update and products/update payloads are applied to the cached catalog
+    in place, so stock checks stay current without refetching products.
+
+    :param catalog_cache: CatalogCache the updates are applied to
+    :param secret: webhook signing secret of the Shopify app
+    :param host: address the receiver listens on
+    :param port: port the receiver listens on
+
+    :ivar received: count of handled webhooks per topic
+    """
+    def __init__(self, catalog_cache, secret, host="0.0.0.0", port=8502):
+        self.catalog_cache = catalog_cache
+        self.secret = secret.encode()
+        self.host = host
+        self.port = port
+        self.received = {}
+        self._server = None
+
+    def verify(self, body, signature):
+        """ Check the X-Shopify-Hmac-Sha256 signature of a webhook body
+        :param body: raw request body
+        :param signature: base64 HMAC-SHA256 sent by Shopify
+        """
+        digest = base64.b64encode(hmac.new(self.secret, body, hashlib.sha256).digest()).decode()
+        return hmac.compare_digest(digest, signature or "")
+
+    def handle(self, topic, body, signature):
+        """ Verify and apply one webhook, returning the HTTP status to answer with.
+        Kept separate from the server so recorded payloads can be replayed directly.
+        :param topic: X-Shopify-Topic header
+        :param body: raw request body
+        :param signature: X-Shopify-Hmac-Sha256 header
+        """
+        if not self.verify(body, signature):
+            return 401
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400
+        if topic == "inventory_levels/update":
+            self.catalog_cache.update_inventory_level(payload["inventory_item_id"], payload["location_id"],
+                                                      payload["available"] or 0)
+        elif topic == "products/update":
+            self.catalog_cache.apply_product(payload)
+        else:
+            # acknowledge topics we do not use so shopify does not retry them
+            return 200
+        self.received[topic] = self.received.get(topic, 0) + 1
+        return 200
+
+    def start(self):
+        """ Serve webhooks from a daemon thread
+        """
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    status = receiver.handle(self.headers.get("X-Shopify-Topic"), body,
+                                             self.headers.get("X-Shopify-Hmac-Sha256"))
+                except Exception as e:
+                    print(f"webhook failed: {e!r}")
+                    status = 500
+                metrics.inc("shopify_webhooks_total", topic=self.headers.get("X-Shopify-Topic", ""), status=status)
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # shopify can send bursts of webhooks, keep them out of the app log
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="shopify-webhooks", daemon=True).start()
+        print(f"listening for shopify webhooks on {self.host}:{self.port}")
+
+    def stop(self):
+        """ Stop serving webhooks
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+@st.cache_resource
+def get_webhook_receiver(_catalog_cache, secret, port=8502):
+    """ Process-wide WebhookReceiver, started once
+    :param _catalog_cache: CatalogCache the updates are applied to, not hashed by streamlit
+    :param secret: webhook signing secret of the Shopify app
+    :param port: port the receiver listens on
+    """
+    receiver = WebhookReceiver(_catalog_cache, secret, port=port)
+    receiver.start()
+    return receiver
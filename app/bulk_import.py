@@ -0,0 +1,143 @@
+from datetime import date
+import pandas as pd
+from app.order_format import ORDER_COLUMNS, ORDER_DEFAULTS, order_channel
+from app.order_numbers import DEPARTMENT_CODES
+
+# CSV columns, one row per line item; rows sharing an order_ref form one order
+# and must repeat the same order level fields
+CSV_COLUMNS = ["order_ref", "department", "customer_name", "address_1", "address_2", "company", "city",
+               "state", "zip_code", "email", "shipping_method", "priority", "ship_by", "product", "sku", "quantity"]
+ORDER_FIELDS = [column for column in CSV_COLUMNS if column not in ("order_ref", "product", "sku", "quantity")]
+REQUIRED_COLUMNS = ["order_ref", "department", "customer_name", "address_1", "city", "state", "zip_code",
+                    "email", "product", "sku", "quantity"]
+# the only ship_by format accepted, an inferred format would come from the first row and reject the others
+SHIP_BY_FORMAT = "%Y-%m-%d"
+
+# CSV column -> order sheet column
+SHEET_COLUMNS = {"customer_name": "Customer name *",
+                 "address_1": "Address line 1 *",
+                 "address_2": "Address line 2",
+                 "company": "Company",
+                 "city": "City *",
+                 "state": "State *",
+                 "zip_code": "Zip code *",
+                 "email": "Email *",
+                 "shipping_method": "Service method",
+                 "priority": "Priority *",
+                 "sku": "SKU *",
+                 "quantity": "Quantity ordered *"}
+
+
+class BulkOrderImporter:
+    """ Imports many orders from one CSV of line items.
+    Every row is checked against the catalog in one vectorized pass with the same rules as the order form,
+    order numbers are reserved per department in bulk and all lines reach the sheet in a single append.
+
+    :param catalog: CatalogIndex of the current catalog
+    :param order_numbers: OrderNumberAllocator handing out sales order numbers
+    :param google_sheets: GoogleSheets the orders are appended to
+    :param order_queue: OrderQueue used as fallback when the append fails
+    :param worksheet: worksheet orders are appended to
+    """
+    def __init__(self, catalog, order_numbers, google_sheets, order_queue, worksheet="Sheet1"):
+        self.catalog = catalog
+        self.order_numbers = order_numbers
+        self.google_sheets = google_sheets
+        self.order_queue = order_queue
+        self.worksheet = worksheet
+
+    def read_csv(self, file):
+        """ Read an uploaded CSV as text so zip codes keep their leading zeros
+        :param file: path or file-like object
+        """
+        lines = pd.read_csv(file, dtype=str, keep_default_na=False)
+        lines.columns = lines.columns.str.strip().str.lower()
+        for column in CSV_COLUMNS:
+            if column not in lines.columns:
+                lines[column] = ""
+        lines[CSV_COLUMNS] = lines[CSV_COLUMNS].apply(lambda column: column.str.strip())
+        return lines[CSV_COLUMNS]
+
+    def validate(self, lines):
+        """ Check every line at once. Returns a frame of problems with the CSV line number, empty when valid.
+        :param lines: frame from read_csv
+        """
+        problems = []
+
+        def flag(mask, message):
+            for row in lines.index[mask]:
+                # header is line 1 in the file
+                problems.append({"line": row + 2, "order_ref": lines.at[row, "order_ref"], "problem": message})
+
+        for column in REQUIRED_COLUMNS:
+            flag(lines[column] == "", f"{column} is required")
+        flag((lines["state"] != "") & ~lines["state"].str.fullmatch(r"[A-Za-z]{2}"), "state must be abbreviated")
+        flag((lines["department"] != "") & ~lines["department"].isin(list(DEPARTMENT_CODES)), "unknown department")
+
+        # only plain digits, 2.5 or 1e1 would otherwise be truncated into a different quantity
+        quantity = pd.to_numeric(lines["quantity"].where(lines["quantity"].str.fullmatch(r"\d+")), errors="coerce")
+        flag((lines["quantity"] != "") & ~(quantity > 0), "quantity must be a whole positive number")
+        ship_by = pd.to_datetime(lines["ship_by"].mask(lines["ship_by"] == ""), format=SHIP_BY_FORMAT, errors="coerce")
+        flag((lines["ship_by"] != "") & ship_by.isna(), "ship_by is not a YYYY-MM-DD date")
+        # an order is built from its first line, so its other lines must not disagree with it
+        differ = lines.groupby("order_ref")[ORDER_FIELDS].transform("nunique").gt(1).any(axis=1)
+        flag((lines["order_ref"] != "") & differ, "order fields differ between lines of this order")
+
+        # catalog lookups as series so the whole file is checked with vectorized maps
+        sku_product = pd.Series({sku: title for title, skus in self.catalog.skus_by_product.items() for sku in skus},
+                                dtype=object)
+        stock = pd.Series(self.catalog.stock_by_sku, dtype="float64")
+        known_sku = lines["sku"].isin(sku_product.index)
+        flag((lines["sku"] != "") & ~known_sku, "sku not in catalog")
+        flag(known_sku & (lines["sku"].map(sku_product) != lines["product"]), "sku does not belong to product")
+        marketing = lines["department"].isin(self.catalog.MARKETING_DEPARTMENTS)
+        flag(marketing & known_sku & ~lines["product"].isin(self.catalog.marketing_titles),
+             "product not available to department")
+        # same 10% rule as the form, applied to the units of a sku across the whole file
+        ordered = quantity.groupby(lines["sku"]).transform("sum")
+        flag(known_sku & (quantity > 0) & ~(lines["sku"].map(stock) * 0.1 > ordered), "not enough stock")
+
+        return pd.DataFrame(problems, columns=["line", "order_ref", "problem"]).sort_values("line", ignore_index=True)
+
+    def build_orders(self, lines):
+        """ Reserve order numbers and lay out every line in the order sheet's columns
+        :param lines: validated frame from read_csv
+        """
+        lines = lines.copy()
+        lines["quantity"] = lines["quantity"].astype(int)
+        # validation made order level fields the same on every line of an order
+        orders = lines.groupby("order_ref", sort=False)[ORDER_FIELDS].first()
+        orders["total"] = lines.groupby("order_ref", sort=False)["quantity"].sum()
+
+        orders["number"] = ""
+        for department, refs in orders.groupby("department").groups.items():
+            orders.loc[refs, "number"] = self.order_numbers.allocate_many(department, len(refs))
+
+        # ship by defaults to today like the form's date picker
+        ship_by = pd.to_datetime(orders["ship_by"].mask(orders["ship_by"] == ""), format=SHIP_BY_FORMAT)
+        ship_by = ship_by.fillna(pd.Timestamp(date.today()))
+        orders["Ship by"] = ship_by.dt.strftime("%m/%d/%y")
+        orders["Channel *"] = orders["total"].map(order_channel)
+        orders["Sales order number *"] = orders["number"]
+
+        rows = lines[["order_ref", "sku", "quantity"]].join(orders, on="order_ref")
+        rows = rows.rename(columns=SHEET_COLUMNS)
+        for column, value in ORDER_DEFAULTS.items():
+            rows[column] = value
+        return rows[ORDER_COLUMNS]
+
+    def submit(self, lines):
+        """ Write every order of a validated CSV to the sheet in one append.
+        Orders fall back to the outbox when the append fails, so none are lost.
+        Returns the sheet rows that were written.
+        :param lines: validated frame from read_csv
+        """
+        rows = self.build_orders(lines)
+        try:
+            self.google_sheets.append_rows(worksheet=self.worksheet, data=rows)
+        except Exception as e:
+            print(f"bulk append failed, queueing orders instead: {e!r}")
+            # the failed call may still have reached the sheet, so the outbox checks before writing them again
+            for number, order in rows.groupby("Sales order number *", sort=False):
+                self.order_queue.enqueue(number, order, attempts=1)
+        return rows
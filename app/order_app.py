@@ -1,41 +1,81 @@
+import hashlib
+from contextlib import nullcontext
 import streamlit as st
 import pandas as pd
-from datetime import date
 from utils.authentication import Authenticator
-from api.shopify_api import ShopifyAPI
-from api.google_sheets import GoogleSheets
+from api.google_sheets import get_google_sheets
+from api.catalog_cache import get_catalog_cache
+from api.webhooks import get_webhook_receiver
+from app.order_queue import get_order_queue
+from app.order_numbers import get_order_number_allocator
+from app.order_format import ORDER_COLUMNS, order_channel
+from app.bulk_import import BulkOrderImporter
+from utils.settings import load_settings
+from utils.metrics import get_metrics, metrics, SamplingProfiler
 
 class OrderApp:
     """ OrderApp made from streamlit that fetches product data information extracted from Shopify API,
     lets app user to place an internal order, and order is loaded onto Google Sheets for warehouse processing.
     
+    Shopify, Google Sheets and the local stores are process-wide and only touched once a user is logged in,
+    so the login page renders without any external calls.
+
     :ivar authenticator: This is an authenticator in streamlit for login and logout with credentials
-    :ivar shopify_api: Initiate ShopifyAPI to extract product data
-    :ivar google_sheets: connects and loads cleaned data into google sheets
-    :ivar product_parse: parses data from shopify api
+    :ivar settings: order app settings from config.yaml
+    :ivar timings: (metric, labels, seconds) of every phase timed in the current run
     """
     
     def __init__(self):
-        self.authenticator = Authenticator()
-        self.shopify_api = ShopifyAPI()
-        self.google_sheets = GoogleSheets()
+        self.settings = load_settings()
+        # switched on before anything else so login and the first catalog load are measured too
+        get_metrics(enabled=self.settings["metrics_enabled"], port=self.settings["metrics_port"])
+        self.timings = []
+        with metrics.span("order_app_phase_seconds", self.timings, phase="auth_setup"):
+            self.authenticator = Authenticator()
+
+    @property
+    def google_sheets(self):
+        """ Shared connection that loads cleaned data into google sheets """
+        return get_google_sheets()
+
+    @property
+    def order_queue(self):
+        """ Durable outbox flushing submitted orders to google sheets """
+        return get_order_queue(path=self.settings["outbox_path"])
+
+    @property
+    def order_numbers(self):
+        """ Allocator handing out unique sales order numbers """
+        return get_order_number_allocator(path=self.settings["order_numbers_path"])
         
     def run(self):
-        # Fetch relevant product data from Shopify API
-        data, p_title_list, marketing_title_list, sku_list, marketing_sku_list = self.fetch_shopify_data()
-        print(len(marketing_sku_list))
+        """ Render the order portal, timing the whole run and sampling it when the profiler is enabled
+        """
+        profiler = SamplingProfiler() if metrics.enabled and self.settings["profiler"] else None
+        try:
+            with profiler or nullcontext(), metrics.span("order_app_run_seconds", self.timings):
+                self.render()
+        finally:
+            # st.stop() ends a run early, what was measured until then is still kept
+            st.session_state["_last_run"] = (self.timings, profiler.top() if profiler and profiler.samples else [])
+            if self.settings["metrics_path"]:
+                metrics.write(self.settings["metrics_path"])
+            if profiler and self.settings["profile_path"]:
+                profiler.write(self.settings["profile_path"])
+
+    def render(self):
         # Order App authenticator setup
-        self.authenticator.login()
+        with metrics.span("order_app_phase_seconds", self.timings, phase="login"):
+            self.authenticator.login()
         if self.authenticator.authentication_status() is False:
             st.error("Username/Password is incorrect")
         elif self.authenticator.authentication_status() is None:
             st.error("Please enter your username and password")
         elif self.authenticator.authentication_status():
-            # Establishing connection - Google Sheets
-            google_sheet = GoogleSheets()
-            existing_data = google_sheet.read_existing_data(worksheet="Sheet1")
-            existing_order_list = set(existing_data['Sales order number *'])
-            
+            # Fetch relevant product data from Shopify API, only for logged in users
+            with metrics.span("order_app_phase_seconds", self.timings, phase="catalog"):
+                catalog = self.fetch_shopify_data()
+
             # Logout button
             self.authenticator.logout(button_name="Logout", location="main")
             
@@ -43,6 +83,21 @@ class OrderApp:
             st.title("Peach and Lily - Order Portal")
             st.markdown("Enter the details of the order below.")
             st.text("* is required")
+            # Orders still waiting in the outbox
+            queue_stats = self.order_queue.stats()
+            metrics.set("outbox_depth", queue_stats["depth"])
+            if queue_stats["depth"]:
+                st.caption(f"{queue_stats['depth']} submitted order(s) waiting to sync to Google Sheets")
+            # Orders Google Sheets kept rejecting are set aside so they do not hold back the rest
+            if queue_stats["failed"]:
+                st.warning(f"{queue_stats['failed']} order(s) were rejected by Google Sheets and need attention: "
+                           f"{', '.join(self.order_queue.failed())}")
+            # A new order number file learns the numbers on the sheet in the background, orders wait until it has
+            order_numbers_ready = self.order_numbers.is_seeded()
+            if not order_numbers_ready:
+                st.caption("Order numbers are syncing with Google Sheets, submitting is enabled once they are ready")
+                if self.order_numbers.seed_error:
+                    st.warning(f"Could not read order numbers from Google Sheets, retrying: {self.order_numbers.seed_error}")
         
             # Initiate Session State
             if 'product' not in st.session_state:
@@ -65,35 +120,27 @@ class OrderApp:
                 # Add to Session State
                 st.session_state["Department"] = ordering_department
                 
-                # Order Number Creation
-                sales_order_number = self.generate_sales_order_number(existing_order_list, ordering_department)
-                
             ## Second Container - order items
             with st.container(border = True):
                 st.subheader("Items")
                 cols = st.columns([2,1,1])
-                dep_list = ["Marketing", "Sales"]
-                print(ordering_department)
-                if ordering_department in dep_list:
-                    title_list = marketing_title_list
-                else:
-                    title_list = p_title_list
+                # Marketing and Sales only see products tagged for marketing
+                title_list = catalog.titles_for(ordering_department)
                 product = cols[0].selectbox("Select product*", title_list, index=None, placeholder="select product", key="productselect")
-                linked_sku = data.loc[data["product"]== product, "SKU"]
+                linked_sku = catalog.skus_for(product)
                 order_sku = cols[1].selectbox("Select sku", options=linked_sku, index=None, placeholder="select sku", key="skuselect")
                 quantity = cols[2].text_input("Enter quantity*", " ", key="quantitykeyed")
     
                 # Button to add item
                 add_item_button = st.button("Add Item")
                 if add_item_button:
-                        if int(data.loc[data["product"] == product, "in_stock"].item()) * 0.1 > int(quantity):
-                            if product and order_sku:
-                                st.session_state["product"].append(product)
-                                st.session_state['SKU'].append(order_sku)
-                                st.session_state["quantity"].append(int(quantity)) 
-                            else:
-                                st.warning("Ensure product and sku are selected")
-                                st.stop()
+                        if not product or not order_sku:
+                            st.warning("Ensure product and sku are selected")
+                            st.stop()
+                        elif catalog.stock(order_sku) * 0.1 > int(quantity):
+                            st.session_state["product"].append(product)
+                            st.session_state['SKU'].append(order_sku)
+                            st.session_state["quantity"].append(int(quantity)) 
                         else:
                             st.warning("Product out of stock")
                             st.stop()
@@ -162,17 +209,14 @@ class OrderApp:
                 ship_by = st.date_input(label="Ship By")
                 
                 # Checking to see if shipment should be B2B or D2C
-                if sum(st.session_state["quantity"]) >= 100:
-                    order_channel = "Influencer B2B"
-                else:
-                    order_channel = "Influencer D2C"
+                channel = order_channel(sum(st.session_state["quantity"]))
 
                 # Initiate order_data dictionary to avoid error
                 order_data = {}
                 order_items = st.session_state
 
                 ## SUBMIT BUTTON
-                submitted = st.form_submit_button("Submit")
+                submitted = st.form_submit_button("Submit", disabled=not order_numbers_ready)
                 # if the submit button is pressed
                 if submitted:
                     # Check if all mandatory filed are filled
@@ -183,9 +227,12 @@ class OrderApp:
                         st.warning("Ensure state is abbreviated")
                         st.stop()
                     else:
+                        # Order Number Creation, only once the order is actually placed
+                        with metrics.span("order_app_phase_seconds", self.timings, phase="order_number"):
+                            sales_order_number = self.generate_sales_order_number(ordering_department)
                         # Create a new row of order data
                         order_data = {
-                        "Channel *": order_channel,
+                        "Channel *": channel,
                         "Sales order number *": sales_order_number,
                         "Custom order reference": "",
                         "Do not ship before": "",
@@ -219,79 +266,91 @@ class OrderApp:
                         # Rename columns
                         orders = pd.concat([order_data_df, order_item_df], axis=1)
                         orders = orders.rename(columns={"SKU": "SKU *", "quantity": "Quantity ordered *"})
-                        orders = orders[[
-                            "Channel *",
-                            "Sales order number *",
-                            "Custom order reference",
-                            "Do not ship before",
-                            "Ship by",
-                            "Priority *",
-                            "Notes",
-                            "Gift message",
-                            "Customer name *",
-                            "Address line 1 *",
-                            "Address line 2",
-                            "Company",
-                            "City *",
-                            "State *",
-                            "Zip code *",
-                            "Country *",
-                            "Email *",
-                            "Contact phone",
-                            "Service method",
-                            "SKU *",
-                            "Quantity ordered *",
-                            "Unit of measure *",
-                            "Lot",
-                            "Sale price",
-                            "Origin facility *",
-                            "Shipment Type"
-                            ]]
+                        orders = orders[ORDER_COLUMNS]
                         
                         # use pd.explode(list("columns")) to split multiple items in cell
                         orders = orders.explode(["SKU *", "Quantity ordered *"])
 
-                        # Add the new order data to the existing data
-                        updated_df = pd.concat([existing_data, orders], ignore_index=True)
-                        
-                        # Update Google Sheets with the new order data
-                        self.google_sheets.update_data(worksheet="Sheet1", data=updated_df)
+                        # Queue the new line items, the outbox worker appends them to Google Sheets
+                        with metrics.span("order_app_phase_seconds", self.timings, phase="enqueue"):
+                            self.order_queue.enqueue(sales_order_number, orders)
                         st.write(f"Order Sumbitted! Order Number is {sales_order_number}")
-    
-    def fetch_shopify_data(self):
-        """Fetch and process relevant data from Shopify API."""
-        shopify_instance = ShopifyAPI()
-        data = shopify_instance.get_product_list()
 
-        # filter to active products
-        data = data[data["parent_status"] == "active"]
-        # isolate only needed columns
-        data = data[["child_sku", "parent_title", "child_inventory_quantity", "parent_tags"]]
-        # rename columns
-        data.rename(columns={"child_sku": "SKU", "parent_title": "product", "child_inventory_quantity": "in_stock", "parent_tags": "tags"}, inplace=True)
-        # title list without limitation
-        p_title_list = list(set(data["product"]))
-        # sku list without limitation
-        sku_list = list(set(data['SKU']))
-        # title list for marketing
-        marketing_data = data[data["tags"].str.contains(r"Marketing")]
-        marketing_title_list = list(set(marketing_data["product"]))
-        # sku list for marketing
-        marketing_sku_list = list(set(marketing_data["SKU"]))
+            ## Bulk import - many orders from one CSV
+            with metrics.span("order_app_phase_seconds", self.timings, phase="bulk_import"):
+                self.bulk_import(catalog, order_numbers_ready)
 
-        return data, p_title_list, marketing_title_list, sku_list, marketing_sku_list    
+            ## Debug panel - this session's run timings and the process-wide metrics
+            if metrics.enabled:
+                self.debug_panel()
+    
+    def fetch_shopify_data(self):
+        """Product and SKU lookups over the shared Shopify catalog cache, rebuilt only when the catalog changes."""
+        catalog_cache = get_catalog_cache(ttl=self.settings["catalog_ttl_seconds"],
+                                          catalog_source=self.settings["catalog_source"],
+                                          snapshot_path=self.settings["catalog_snapshot_path"],
+                                          lean=self.settings["catalog_lean"],
+                                          concurrency=self.settings["catalog_concurrency"])
+        # Shopify webhooks keep stock current between refreshes when a receiver port is configured
+        if self.settings["webhook_port"]:
+            get_webhook_receiver(catalog_cache, st.secrets["shopify_webhook_secret"], port=self.settings["webhook_port"])
+        return catalog_cache.index()
         
-    def generate_sales_order_number(self, existing_order_list, department):
-        department_code = {"Marketing": "MKT",
-                           "Sales": "SLS", 
-                           "Operations": "OPS", 
-                           "Finance": "FIN"}
-        number_start = 1
-        today_date = date.today().strftime("%m%d%y")
-        sales_order_number = f"{department_code.get(department, 'MKT')}{today_date}{number_start}"
+    def generate_sales_order_number(self, department):
+        """ Allocate the next sales order number for the department from the local allocator.
+        Counters are seeded from the order sheet once, in the background, when the allocator is created.
+        :param department: ordering department
+        """
+        return self.order_numbers.allocate(department)
 
-        while sales_order_number in existing_order_list:
-            number_start += 1
-            sales_order_number = f"{department_code.get(department, 'MKT')}{today_date}{number_start}"
+    def bulk_import(self, catalog, order_numbers_ready=True):
+        """ Upload a CSV of orders, validate every line against the catalog and submit them in one append
+        :param catalog: CatalogIndex of the current catalog
+        :param order_numbers_ready: whether counters know the numbers already on the sheet, submitting waits until then
+        """
+        with st.expander("Bulk import orders (CSV)"):
+            st.caption("One row per line item, rows with the same order_ref form one order and repeat its "
+                       "order fields. Columns: order_ref, department, customer_name, address_1, address_2, "
+                       "company, city, state, zip_code, email, shipping_method, priority, ship_by (YYYY-MM-DD), "
+                       "product, sku, quantity")
+            uploaded = st.file_uploader("Upload orders CSV", type="csv", key="bulkcsv")
+            if uploaded is None:
+                return
+            # the file stays in the uploader after submitting, never write the same file twice in a session
+            digest = hashlib.sha256(uploaded.getvalue()).hexdigest()
+            submitted = st.session_state.setdefault("_bulk_submitted", {})
+            if digest in submitted:
+                st.info(f"This file was already submitted, Order Numbers are {submitted[digest]}. "
+                        "Remove it or upload a different file.")
+                return
+            importer = BulkOrderImporter(catalog, self.order_numbers, self.google_sheets, self.order_queue)
+            lines = importer.read_csv(uploaded)
+            if lines.empty:
+                st.warning("CSV has no order lines")
+                return
+            problems = importer.validate(lines)
+            if not problems.empty:
+                st.warning(f"{len(problems)} problem(s) found, fix the CSV and upload it again")
+                st.dataframe(problems, hide_index=True)
+                return
+            st.write(f"{lines['order_ref'].nunique()} orders with {len(lines)} lines ready to submit")
+            if st.button("Submit all orders", key="bulksubmit", disabled=not order_numbers_ready):
+                rows = importer.submit(lines)
+                submitted[digest] = ", ".join(rows["Sales order number *"].unique())
+                st.write(f"Orders Submitted! Order Numbers are {submitted[digest]}")
 
-        return sales_order_number
\ No newline at end of file
+    def debug_panel(self):
+        """ Phase timings of this session's last complete run, next to the process-wide counters and histograms
+        """
+        with st.expander("Debug metrics"):
+            last_run, hottest = st.session_state.get("_last_run", ([], []))
+            if last_run:
+                st.caption("Previous run of this session")
+                st.dataframe(pd.DataFrame([{"metric": name, "phase": labels.get("phase", ""),
+                                            "seconds": round(seconds, 4)} for name, labels, seconds in last_run]),
+                             hide_index=True)
+            if hottest:
+                st.caption("Hottest functions of the previous run, share of samples")
+                st.dataframe(pd.DataFrame(hottest, columns=["function", "share"]), hide_index=True)
+            st.caption("Process totals since start")
+            st.dataframe(pd.DataFrame(metrics.series()), hide_index=True)
\ No newline at end of file
@@ -0,0 +1,54 @@
+# Columns of the warehouse order sheet, in sheet order
+ORDER_COLUMNS = [
+    "Channel *",
+    "Sales order number *",
+    "Custom order reference",
+    "Do not ship before",
+    "Ship by",
+    "Priority *",
+    "Notes",
+    "Gift message",
+    "Customer name *",
+    "Address line 1 *",
+    "Address line 2",
+    "Company",
+    "City *",
+    "State *",
+    "Zip code *",
+    "Country *",
+    "Email *",
+    "Contact phone",
+    "Service method",
+    "SKU *",
+    "Quantity ordered *",
+    "Unit of measure *",
+    "Lot",
+    "Sale price",
+    "Origin facility *",
+    "Shipment Type"
+    ]
+
+# Values that are the same on every order line
+ORDER_DEFAULTS = {
+    "Custom order reference": "",
+    "Do not ship before": "",
+    "Notes": "",
+    "Gift message": "",
+    "Country *": "United States",
+    "Contact phone": "",
+    "Unit of measure *": "ea",
+    "Lot": "",
+    "Sale price": "",
+    "Origin facility *": "BDLs001",
+    "Shipment Type": "Parcel"
+    }
+
+# orders of at least this many units ship as B2B
+B2B_QUANTITY = 100
+
+
+def order_channel(total_quantity):
+    """ Shipment channel of an order from its total quantity
+    :param total_quantity: units across every line of the order
+    """
+    return "Influencer B2B" if total_quantity >= B2B_QUANTITY else "Influencer D2C"
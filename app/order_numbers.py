@@ -0,0 +1,131 @@
+import re
+import sqlite3
+import threading
+import time
+from datetime import date
+import streamlit as st
+from api.google_sheets import get_google_sheets
+
+# department prefix used in sales order numbers
+DEPARTMENT_CODES = {"Marketing": "MKT",
+                    "Sales": "SLS",
+                    "Operations": "OPS",
+                    "Finance": "FIN"}
+
+# department code, MMDDYY order date, then the running number of that day
+ORDER_NUMBER_PATTERN = re.compile(r"^([A-Z]{3})(\d{6})(\d+)$")
+
+
+class OrderNumberAllocator:
+    """ Hands out sales order numbers from a per-department, per-day counter.
+    Counters live in a local SQLite file and every allocation is a single transaction,
+    so numbers are unique across threads, sessions and processes on this machine and
+    survive restarts without rescanning the sheet.
+
+    :param path: sqlite file holding the counters
+
+    :ivar seed_error: last error of the background seeding, cleared once seeding succeeds
+    """
+    def __init__(self, path="order_numbers.sqlite3"):
+        self.seed_error = None
+        self._seeded = False
+        self._seeder = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS counters (prefix TEXT PRIMARY KEY, last INTEGER NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def is_seeded(self):
+        """ Whether counters were already seeded from existing orders
+        """
+        # once seeded always seeded, later calls skip the query
+        if not self._seeded:
+            with self._lock:
+                self._seeded = self._db.execute("SELECT 1 FROM meta WHERE key = 'seeded'").fetchone() is not None
+        return self._seeded
+
+    def seed(self, order_numbers):
+        """ Raise counters to the highest number already used for each department and day
+        :param order_numbers: existing sales order numbers
+        """
+        highest = {}
+        for order_number in order_numbers:
+            match = ORDER_NUMBER_PATTERN.match(str(order_number))
+            if match:
+                prefix = match.group(1) + match.group(2)
+                highest[prefix] = max(highest.get(prefix, 0), int(match.group(3)))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT INTO counters (prefix, last) VALUES (?, ?) "
+                    "ON CONFLICT(prefix) DO UPDATE SET last = MAX(last, excluded.last)",
+                    highest.items())
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded', '1')")
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def seed_in_background(self, read_order_numbers, max_backoff=60):
+        """ Seed the counters from a daemon thread, retrying with backoff until the order numbers can be read
+        :param read_order_numbers: function returning the sales order numbers already used
+        :param max_backoff: longest wait in seconds between retries
+        """
+        def run():
+            backoff = 0
+            while not self.is_seeded():
+                try:
+                    self.seed(read_order_numbers())
+                except Exception as e:
+                    self.seed_error = repr(e)
+                    backoff = min(max(backoff * 2, 1), max_backoff)
+                    print(f"order number seeding failed, retrying in {backoff}s: {e!r}")
+                    time.sleep(backoff)
+                else:
+                    self.seed_error = None
+
+        with self._lock:
+            if self._seeder is None:
+                self._seeder = threading.Thread(target=run, name="order-number-seed", daemon=True)
+                self._seeder.start()
+
+    def allocate_many(self, department, count, order_date=None):
+        """ Reserve count consecutive order numbers for a department
+        :param department: ordering department, unknown departments fall back to Marketing
+        :param count: how many numbers to reserve
+        :param order_date: date the numbers are for, today by default
+        """
+        order_date = order_date or date.today()
+        prefix = f"{DEPARTMENT_CODES.get(department, 'MKT')}{order_date.strftime('%m%d%y')}"
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("INSERT OR IGNORE INTO counters (prefix, last) VALUES (?, 0)", (prefix,))
+                self._db.execute("UPDATE counters SET last = last + ? WHERE prefix = ?", (count, prefix))
+                last = self._db.execute("SELECT last FROM counters WHERE prefix = ?", (prefix,)).fetchone()[0]
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return [f"{prefix}{number}" for number in range(last - count + 1, last + 1)]
+
+    def allocate(self, department, order_date=None):
+        """ Reserve the next order number for a department
+        :param department: ordering department, unknown departments fall back to Marketing
+        :param order_date: date the number is for, today by default
+        """
+        return self.allocate_many(department, 1, order_date=order_date)[0]
+
+
+@st.cache_resource
+def get_order_number_allocator(path="order_numbers.sqlite3"):
+    """ Process-wide OrderNumberAllocator, seeded from the order sheet in the background when its file is new
+    :param path: sqlite file holding the counters
+    """
+    allocator = OrderNumberAllocator(path=path)
+    # counters learn the numbers already on the sheet here, so placing an order never waits on Sheets
+    if not allocator.is_seeded():
+        allocator.seed_in_background(lambda: get_google_sheets().read_order_numbers(worksheet="Sheet1"))
+    return allocator
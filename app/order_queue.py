@@ -0,0 +1,217 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+import streamlit as st
+import pandas as pd
+from api.google_sheets import get_google_sheets, sheet_rows
+from utils.metrics import metrics
+
+
+class OrderQueue:
+    """ Durable outbox between the order form and Google Sheets.
+    Submitted orders are written to a local SQLite file in WAL mode and acknowledged right away;
+    a background worker flushes pending orders to the sheet in coalesced batches and retries
+    with backoff when Sheets is slow or failing. The sales order number is the primary key,
+    so an order is queued and written at most once. After a failed append the oldest order is retried
+    on its own, and an order Sheets keeps rejecting is marked failed so it cannot hold back the rest.
+
+    :param google_sheets: GoogleSheets the orders are flushed to
+    :param path: sqlite file holding the outbox
+    :param worksheet: worksheet orders are appended to
+    :param batch_size: most orders coalesced into one append
+    :param flush_interval: seconds the worker waits for new orders before checking again
+    :param max_backoff: longest wait in seconds between retries of a failing flush
+    :param max_attempts: appends of an order Sheets rejects before it is marked failed
+
+    :ivar flush_latencies: seconds taken by the most recent successful flushes
+    :ivar last_error: last flush error, cleared after a successful flush
+    """
+    def __init__(self, google_sheets, path="order_outbox.sqlite3", worksheet="Sheet1", batch_size=50,
+                 flush_interval=1.0, max_backoff=60, max_attempts=3):
+        self.google_sheets = google_sheets
+        self.worksheet = worksheet
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.flush_latencies = deque(maxlen=100)
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                sales_order_number TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            )""")
+
+    def enqueue(self, sales_order_number, orders, attempts=0):
+        """ Queue the line items of one order for writing to the sheet.
+        Returns False when the order number was already queued.
+        :param sales_order_number: order number the rows belong to
+        :param orders: dataframe of line items in the worksheet's column order
+        :param attempts: appends of these rows already tried elsewhere, any makes the first flush check the sheet
+        """
+        payload = json.dumps({
+            "columns": list(orders.columns),
+            "rows": sheet_rows(orders),
+        }, default=lambda value: value.item() if hasattr(value, "item") else str(value))
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO outbox (sales_order_number, payload, attempts, created_at) VALUES (?, ?, ?, ?)",
+                (sales_order_number, payload, attempts, time.time()))
+        metrics.inc("outbox_enqueued_total")
+        self._wake.set()
+        return cursor.rowcount == 1
+
+    def depth(self):
+        """ Number of orders waiting to be written to the sheet
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def stats(self):
+        """ Backlog and flush timings for monitoring the queue
+        """
+        with self._lock:
+            depth, oldest, failed = self._db.execute(
+                "SELECT COALESCE(SUM(status = 'pending'), 0), MIN(CASE WHEN status = 'pending' THEN created_at END), "
+                "COALESCE(SUM(status = 'failed'), 0) FROM outbox").fetchone()
+        latencies = list(self.flush_latencies)
+        return {
+            "depth": depth,
+            "failed": failed,
+            "oldest_pending_seconds": time.time() - oldest if oldest else 0.0,
+            "last_flush_seconds": latencies[-1] if latencies else None,
+            "max_flush_seconds": max(latencies) if latencies else None,
+            "last_error": self.last_error,
+        }
+
+    def failed(self):
+        """ Order numbers Sheets kept rejecting, oldest first
+        """
+        with self._lock:
+            return [number for number, in self._db.execute(
+                "SELECT sales_order_number FROM outbox WHERE status = 'failed' ORDER BY created_at")]
+
+    def retry_failed(self):
+        """ Put failed orders back in the queue, e.g. after fixing the sheet they were rejected by.
+        Returns the number of orders requeued.
+        """
+        with self._lock:
+            cursor = self._db.execute("UPDATE outbox SET status = 'pending', attempts = 1 WHERE status = 'failed'")
+        self._wake.set()
+        return cursor.rowcount
+
+    def start(self):
+        """ Start the background flush worker once per queue
+        """
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="order-queue-flush", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        backoff = 0
+        while True:
+            self._wake.wait(timeout=self.flush_interval)
+            self._wake.clear()
+            try:
+                # keep flushing until the queue is empty
+                while self.flush():
+                    pass
+            except Exception as e:
+                self.last_error = repr(e)
+                backoff = min(max(backoff * 2, 1), self.max_backoff)
+                print(f"order queue flush failed, retrying in {backoff}s: {e!r}")
+                metrics.inc("outbox_flush_errors_total")
+                time.sleep(backoff)
+            else:
+                self.last_error = None
+                backoff = 0
+
+    def flush(self):
+        """ Write the oldest pending orders to the sheet in a single append.
+        Returns the number of orders taken from the queue, including an order marked failed.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                pending = self._db.execute(
+                    "SELECT sales_order_number, payload, attempts FROM outbox WHERE status = 'pending' "
+                    "ORDER BY created_at LIMIT ?", (self.batch_size,)).fetchall()
+                # after a failed append the oldest order goes alone, so a row Sheets rejects is found
+                # and the orders queued behind it are not retried with it
+                if pending and pending[0][2]:
+                    pending = pending[:1]
+                # counted before the append, so an order whose append reached the sheet but was never
+                # marked sent (a crash or a timeout after the write) is looked up on the sheet next time
+                self._db.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE sales_order_number = ?",
+                                     [(number,) for number, _, _ in pending])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if not pending:
+            return 0
+
+        # an earlier failed append may still have reached the sheet, skip orders already there
+        already_sent = set()
+        if any(attempts for _, _, attempts in pending):
+            already_sent = set(self.google_sheets.read_order_numbers(worksheet=self.worksheet))
+        to_send = [(number, payload) for number, payload, _ in pending if number not in already_sent]
+
+        start = time.perf_counter()
+        if to_send:
+            frames = []
+            for _, payload in to_send:
+                order = json.loads(payload)
+                frames.append(pd.DataFrame(order["rows"], columns=order["columns"]))
+            try:
+                self.google_sheets.append_rows(worksheet=self.worksheet, data=pd.concat(frames, ignore_index=True))
+            except Exception as e:
+                number, _, attempts = pending[0]
+                if len(pending) == 1 and attempts + 1 >= self.max_attempts and is_rejection(e):
+                    with self._lock:
+                        self._db.execute("UPDATE outbox SET status = 'failed' WHERE sales_order_number = ?", (number,))
+                    print(f"order {number} rejected by google sheets {attempts + 1} times, marked failed: {e!r}")
+                    metrics.inc("outbox_failed_total")
+                    return 1
+                raise
+            self.flush_latencies.append(time.perf_counter() - start)
+            metrics.observe("outbox_flush_seconds", self.flush_latencies[-1])
+
+        with self._lock:
+            self._db.executemany("UPDATE outbox SET status = 'sent', sent_at = ? WHERE sales_order_number = ?",
+                                 [(time.time(), number) for number, _, _ in pending])
+        metrics.inc("outbox_sent_total", len(pending))
+        return len(pending)
+
+
+def is_rejection(error):
+    """ Whether Sheets refused the request itself, a 4xx other than timeout or throttling, so sending
+    the same rows again cannot succeed
+    :param error: exception raised by the append
+    """
+    # gspread's APIError keeps the http response
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+@st.cache_resource
+def get_order_queue(path="order_outbox.sqlite3"):
+    """ Process-wide OrderQueue with its flush worker running
+    :param path: sqlite file holding the outbox
+    """
+    queue = OrderQueue(get_google_sheets(), path=path)
+    queue.start()
+    return queue
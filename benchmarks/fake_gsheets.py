@@ -0,0 +1,115 @@
+import random
+import threading
+import time
+import pandas as pd
+from app.order_format import ORDER_COLUMNS
+
+
+def make_order_rows(count, seed=0):
+    """ Build existing order sheet rows, a few line items per order
+    :param count: number of rows
+    :param seed: random seed so runs are comparable
+    """
+    rng = random.Random(seed)
+    rows = []
+    order = 0
+    while len(rows) < count:
+        order += 1
+        day = f"{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}24"
+        number = f"{rng.choice(['MKT', 'SLS', 'OPS', 'FIN'])}{day}{order}"
+        for _ in range(min(rng.randint(1, 4), count - len(rows))):
+            row = {column: "" for column in ORDER_COLUMNS}
+            row.update({"Channel *": "Influencer D2C", "Sales order number *": number, "Ship by": "01/01/24",
+                        "Priority *": "Medium", "Customer name *": f"Customer {order}",
+                        "Address line 1 *": f"{order} Main St", "City *": "New York", "State *": "NY",
+                        "Zip code *": "10001", "Country *": "United States", "Email *": f"c{order}@example.com",
+                        "SKU *": f"SKU{rng.randint(1, 1000):07d}", "Quantity ordered *": str(rng.randint(1, 20)),
+                        "Unit of measure *": "ea", "Origin facility *": "BDLs001", "Shipment Type": "Parcel"})
+            rows.append([row[column] for column in ORDER_COLUMNS])
+    return rows
+
+
+def make_order(number, lines=1):
+    """ One submitted order as the order form builds it, line items in the sheet's column order
+    :param number: sales order number of every line
+    :param lines: number of line items
+    """
+    rows = [dict({column: "" for column in ORDER_COLUMNS},
+                 **{"Sales order number *": number, "SKU *": f"SKU{line + 1:07d}", "Quantity ordered *": 1})
+            for line in range(lines)]
+    return pd.DataFrame(rows)[ORDER_COLUMNS]
+
+
+class FakeWorksheet:
+    """ In-memory stand-in for the gspread worksheet calls GoogleSheets makes
+    :param rows: sheet contents including the header row
+    :param latency: seconds added to every call
+
+    :ivar calls: count of calls per method
+    :ivar cells_sent: cells written by append_rows
+    """
+    def __init__(self, rows, latency=0.0):
+        self.rows = rows
+        self.latency = latency
+        self.calls = {}
+        self.cells_sent = 0
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def row_values(self, row):
+        self._call("row_values")
+        return list(self.rows[row - 1])
+
+    def col_values(self, col):
+        self._call("col_values")
+        values = [row[col - 1] if col - 1 < len(row) else "" for row in self.rows]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def get(self, range_name):
+        """ Only single column ranges such as B5:B, as used by GoogleSheets.read_column """
+        self._call("get")
+        start, _ = range_name.split(":")
+        letters = start.rstrip("0123456789")
+        first_row = int(start[len(letters):])
+        col = 0
+        for letter in letters:
+            col = col * 26 + ord(letter) - ord("A") + 1
+        return [[row[col - 1]] if row[col - 1] != "" else [] for row in self.rows[first_row - 1:]]
+
+    def append_rows(self, values, value_input_option="RAW"):
+        self._call("append_rows")
+        with self._lock:
+            self.rows.extend([str(value) for value in row] for row in values)
+        self.cells_sent += sum(len(row) for row in values)
+
+
+class FakeGSheetsConnection:
+    """ In-memory stand-in for streamlit's GSheetsConnection, including the client it wraps
+    :param rows: existing order rows without the header
+    :param latency: seconds added to every worksheet call
+
+    :ivar worksheet: the single FakeWorksheet behind every worksheet name
+    :ivar cells_sent: cells written by update
+    """
+    def __init__(self, rows=(), latency=0.0):
+        self.worksheet = FakeWorksheet([list(ORDER_COLUMNS)] + [list(row) for row in rows], latency=latency)
+        self.client = self
+        self.cells_sent = 0
+
+    def _select_worksheet(self, worksheet=None):
+        return self.worksheet
+
+    def read(self, worksheet=None, ttl=None):
+        self.worksheet._call("read")
+        return pd.DataFrame(self.worksheet.rows[1:], columns=self.worksheet.rows[0])
+
+    def update(self, worksheet=None, data=None):
+        self.worksheet._call("update")
+        self.worksheet.rows = [list(data.columns)] + data.astype(str).values.tolist()
+        self.cells_sent += data.size
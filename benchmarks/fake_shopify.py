@@ -0,0 +1,213 @@
+import base64
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+API_PREFIX = "/admin/api/2024-01"
+
+
+def make_catalog(variants, variants_per_product=5, marketing_share=0.3, seed=0):
+    """ Build a synthetic catalog shaped like products.json
+    :param variants: total number of variants
+    :param variants_per_product: variants of each product
+    :param marketing_share: share of products tagged Marketing
+    :param seed: random seed so runs are comparable
+    """
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    products = []
+    variant_id = 1
+    for product_number in range(1, -(-variants // variants_per_product) + 1):
+        created_at = (start + timedelta(hours=product_number)).isoformat(timespec="seconds")
+        tags = "Marketing, Skincare" if rng.random() < marketing_share else "Skincare"
+        product = {
+            "id": product_number, "title": f"Product {product_number}", "status": "active", "tags": tags,
+            "created_at": created_at, "updated_at": created_at, "body_html": "<p>" + "x" * 200 + "</p>",
+            "vendor": "Peach and Lily", "product_type": "Skincare",
+            "images": [{"id": product_number, "src": f"https://cdn.example.com/{product_number}.jpg"}],
+            "options": [{"name": "Size", "values": ["S", "M", "L"]}],
+            "variants": [],
+        }
+        for _ in range(min(variants_per_product, variants - variant_id + 1)):
+            product["variants"].append({
+                "id": variant_id, "product_id": product_number, "sku": f"SKU{variant_id:07d}",
+                "title": "Default", "price": "25.00", "inventory_quantity": rng.randint(0, 5000),
+                "inventory_item_id": 1_000_000 + variant_id, "weight": 0.2, "weight_unit": "kg",
+                "barcode": f"{variant_id:012d}", "created_at": created_at, "updated_at": created_at,
+            })
+            variant_id += 1
+        products.append(product)
+    return products
+
+
+class FakeShopify:
+    """ Local stand-in for the Shopify admin api used by ShopifyAPI.
+    Serves products.json with Link header pagination and call-limit headers, and a GraphQL bulk
+    operation whose JSONL result is streamed from memory. Latency and throttling can be injected.
+
+    :param products: catalog from make_catalog
+    :param latency: seconds added to every response
+    :param throttle_rate: share of requests answered with 429
+    :param bucket_size: call limit reported in X-Shopify-Shop-Api-Call-Limit
+    :param leak_rate: calls drained from the bucket per second, requests over the limit get 429
+
+    :ivar requests: count of requests served per path
+    :ivar url: base url of the running server
+    """
+    def __init__(self, products, latency=0.0, throttle_rate=0.0, bucket_size=40, leak_rate=2.0):
+        self.products = products
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.bucket_size = bucket_size
+        self.leak_rate = leak_rate
+        self.requests = {}
+        self.url = None
+        self._level = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._random = random.Random(1)
+        self._server = None
+
+    def start(self):
+        """ Serve on a free local port from a daemon thread
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fake.dispatch(self, "GET")
+
+            def do_POST(self):
+                fake.dispatch(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """ Stop the server
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _take_call(self):
+        """ Leaky bucket like shopify's, returns the level after the call or None when over the limit """
+        with self._lock:
+            now = time.monotonic()
+            self._level = max(0.0, self._level - (now - self._updated) * self.leak_rate)
+            self._updated = now
+            if self._level + 1 > self.bucket_size or self._random.random() < self.throttle_rate:
+                return None
+            self._level += 1
+            return int(self._level)
+
+    def dispatch(self, handler, method):
+        url = urlparse(handler.path)
+        self.requests[url.path] = self.requests.get(url.path, 0) + 1
+        body = handler.rfile.read(int(handler.headers.get("Content-Length", 0))) if method == "POST" else b""
+        if self.latency:
+            time.sleep(self.latency)
+        if url.path == "/bulk/result.jsonl":
+            return self.send_bulk_result(handler)
+        level = self._take_call()
+        if level is None:
+            return self.send(handler, 429, {"errors": "Exceeded 2 calls per second for api client."},
+                             {"Retry-After": "1.0"})
+        headers = {"X-Shopify-Shop-Api-Call-Limit": f"{level}/{self.bucket_size}"}
+        if url.path == f"{API_PREFIX}/products.json":
+            return self.send_products(handler, parse_qs(url.query), headers)
+        if url.path == f"{API_PREFIX}/graphql.json":
+            return self.send_graphql(handler, json.loads(body), headers)
+        return self.send(handler, 404, {"errors": "Not Found"}, headers)
+
+    def send(self, handler, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def select(self, query):
+        """ Products matching the products.json filters, in id order """
+        products = self.products
+        since_id = int(query.get("since_id", ["0"])[0])
+        if since_id:
+            products = [product for product in products if product["id"] > since_id]
+        for name, keep in (("updated_at_min", lambda value, bound: value >= bound),
+                           ("created_at_min", lambda value, bound: value >= bound),
+                           ("created_at_max", lambda value, bound: value <= bound)):
+            if name in query:
+                bound = datetime.fromisoformat(query[name][0])
+                field = name.rsplit("_", 1)[0]
+                products = [product for product in products if keep(datetime.fromisoformat(product[field]), bound)]
+        return products
+
+    def send_products(self, handler, query, headers):
+        limit = int(query.get("limit", ["50"])[0])
+        fields = query.get("fields", [None])[0]
+        if "page_info" in query:
+            cursor = json.loads(base64.urlsafe_b64decode(query["page_info"][0]))
+            offset, filters = cursor["offset"], cursor["filters"]
+        else:
+            offset = 0
+            filters = {name: values for name, values in query.items()
+                       if name in ("since_id", "updated_at_min", "created_at_min", "created_at_max")}
+        selected = self.select(filters)
+        page = selected[offset:offset + limit]
+        if fields:
+            keep = fields.split(",")
+            page = [{name: product[name] for name in keep if name in product} for product in page]
+        if offset + limit < len(selected):
+            cursor = base64.urlsafe_b64encode(json.dumps({"offset": offset + limit, "filters": filters}).encode())
+            next_query = {"limit": limit, "page_info": cursor.decode()}
+            if fields:
+                next_query["fields"] = fields
+            headers["Link"] = f'<{self.url}{API_PREFIX}/products.json?{urlencode(next_query)}>; rel="next"'
+        self.send(handler, 200, {"products": page}, headers)
+
+    def send_graphql(self, handler, body, headers):
+        query = body["query"]
+        if "bulkOperationRunQuery" in query:
+            payload = {"data": {"bulkOperationRunQuery": {
+                "bulkOperation": {"id": "gid://shopify/BulkOperation/1", "status": "CREATED"}, "userErrors": []}}}
+        else:
+            payload = {"data": {"currentBulkOperation": {
+                "id": "gid://shopify/BulkOperation/1", "status": "COMPLETED", "errorCode": None,
+                "objectCount": str(len(self.products)), "url": f"{self.url}/bulk/result.jsonl"}}}
+        self.send(handler, 200, payload, headers)
+
+    def bulk_lines(self):
+        """ The catalog as bulk operation JSONL, products followed by their variants """
+        for product in self.products:
+            product_gid = f"gid://shopify/Product/{product['id']}"
+            yield json.dumps({"id": product_gid, "title": product["title"], "status": product["status"].upper(),
+                              "tags": product["tags"].split(", ")})
+            for variant in product["variants"]:
+                yield json.dumps({"id": f"gid://shopify/ProductVariant/{variant['id']}", "sku": variant["sku"],
+                                  "inventoryQuantity": variant["inventory_quantity"],
+                                  "inventoryItem": {"id": f"gid://shopify/InventoryItem/{variant['inventory_item_id']}"},
+                                  "__parentId": product_gid})
+
+    def send_bulk_result(self, handler):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/jsonl")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        for line in self.bulk_lines():
+            chunk = (line + "\n").encode()
+            handler.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        handler.wfile.write(b"0\r\n\r\n")
@@ -0,0 +1,178 @@
+""" Benchmarks for the catalog and order paths against local fake Shopify and Google Sheets backends.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks            # quick sizes
+    python -m benchmarks.run_benchmarks --full     # 1k-100k variants, 1k-500k order rows
+
+Each run is saved to benchmarks/results/ and compared with the previous run, slower scenarios are flagged.
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import pandas as pd
+from api.rate_limiter import LeakyBucket
+from api.shopify_api import ShopifyAPI
+from api.catalog_index import CatalogIndex
+from api.google_sheets import GoogleSheets
+from app.order_numbers import OrderNumberAllocator
+from app.order_queue import OrderQueue
+from benchmarks.fake_shopify import FakeShopify, make_catalog
+from benchmarks.fake_gsheets import FakeGSheetsConnection, make_order, make_order_rows
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+QUICK = {"variants": [1_000, 10_000], "order_rows": [1_000, 100_000]}
+FULL = {"variants": [1_000, 10_000, 100_000], "order_rows": [1_000, 100_000, 500_000]}
+
+# catalog fetch modes, ShopifyAPI keyword arguments
+FETCH_MODES = {
+    "rest-full": {"lean": False},
+    "rest-lean": {"lean": True},
+    "rest-lean-concurrent4": {"lean": True, "concurrency": 4},
+    "bulk": {"catalog_source": "bulk"},
+}
+
+
+def measure(function):
+    """ Run function once and return its result with wall time and peak traced memory """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def record(results, scenario, size, seconds, peak, units, **extra):
+    results.append(dict({"scenario": scenario, "size": size, "seconds": round(seconds, 4),
+                         "throughput_per_s": round(units / seconds, 1) if seconds else None,
+                         "peak_mb": round(peak / 2 ** 20, 2)}, **extra))
+    print(f"{scenario:<40} {size:>8} {seconds:>9.3f}s {results[-1]['throughput_per_s'] or 0:>12,.0f}/s "
+          f"{results[-1]['peak_mb']:>9.1f}MB {extra or ''}")
+
+
+def bench_catalog_fetch(results, sizes, latency, throttle_rate, bucket_size):
+    """ ShopifyAPI.get_product_list in every mode, plus building the lookup index used by the order form """
+    for variants in sizes["variants"]:
+        fake = FakeShopify(make_catalog(variants), latency=latency, throttle_rate=throttle_rate,
+                           bucket_size=bucket_size, leak_rate=bucket_size / LeakyBucket.DRAIN_SECONDS).start()
+        try:
+            for mode, options in FETCH_MODES.items():
+                fake.requests.clear()
+                shopify_api = ShopifyAPI(base_url=fake.url, access_token="benchmark", rate_limiter=LeakyBucket(),
+                                         **options)
+                shopify_api.BULK_POLL_INTERVAL = 0.01
+                data, seconds, peak = measure(shopify_api.get_product_list)
+                assert len(data) == variants, f"{mode} returned {len(data)} of {variants} variants"
+                record(results, f"catalog_fetch[{mode}]", variants, seconds, peak, variants,
+                       requests=sum(fake.requests.values()),
+                       frame_mb=round(shopify_api.parse_stats["memory_bytes"] / 2 ** 20, 2))
+                if mode == "rest-lean":
+                    index, seconds, peak = measure(lambda: CatalogIndex(data, version=1))
+                    record(results, "catalog_index_build", variants, seconds, peak, variants)
+                    skus = list(index.stock_by_sku)
+                    titles = list(index.skus_by_product)
+                    _, seconds, peak = measure(lambda: [(index.skus_for(title), index.stock(sku))
+                                                        for title, sku in zip(titles * 10, skus)])
+                    record(results, "catalog_index_lookups", variants, seconds, peak, min(len(titles) * 10, len(skus)))
+        finally:
+            fake.stop()
+
+
+def bench_orders(results, sizes, sheets_latency):
+    """ Order number seeding and allocation, incremental order number reads and the submit path """
+    with tempfile.TemporaryDirectory() as workdir:
+        for order_rows in sizes["order_rows"]:
+            conn = FakeGSheetsConnection(make_order_rows(order_rows), latency=sheets_latency)
+            google_sheets = GoogleSheets(conn=conn)
+
+            numbers, seconds, peak = measure(lambda: google_sheets.read_order_numbers("Sheet1"))
+            record(results, "read_order_numbers[cold]", order_rows, seconds, peak, order_rows)
+
+            allocator = OrderNumberAllocator(path=os.path.join(workdir, f"numbers_{order_rows}.sqlite3"))
+            _, seconds, peak = measure(lambda: allocator.seed(numbers))
+            record(results, "order_numbers_seed", order_rows, seconds, peak, order_rows)
+            _, seconds, peak = measure(lambda: [allocator.allocate("Marketing") for _ in range(1_000)])
+            record(results, "order_numbers_allocate_x1000", order_rows, seconds, peak, 1_000)
+
+            order = make_order("MKT010124900000", lines=3)
+            conn.worksheet.cells_sent = 0
+            _, seconds, peak = measure(lambda: google_sheets.append_rows("Sheet1", order))
+            record(results, "submit_append_rows", order_rows, seconds, peak, len(order),
+                   cells_sent=conn.worksheet.cells_sent)
+
+            _, seconds, peak = measure(lambda: google_sheets.read_order_numbers("Sheet1"))
+            record(results, "read_order_numbers[incremental]", order_rows, seconds, peak, len(order))
+
+            # the previous submit path, kept to show what append_rows saves
+            def full_rewrite():
+                existing_data = google_sheets.read_existing_data("Sheet1")
+                google_sheets.update_data("Sheet1", pd.concat([existing_data, order], ignore_index=True))
+            conn.cells_sent = 0
+            _, seconds, peak = measure(full_rewrite)
+            record(results, "submit_full_rewrite[legacy]", order_rows, seconds, peak, len(order),
+                   cells_sent=conn.cells_sent)
+
+            queue = OrderQueue(google_sheets, path=os.path.join(workdir, f"outbox_{order_rows}.sqlite3"))
+            orders = [order.assign(**{"Sales order number *": f"SLS010124{number}"}) for number in range(200)]
+            _, seconds, peak = measure(lambda: [queue.enqueue(f"SLS010124{number}", frame)
+                                                for number, frame in enumerate(orders)])
+            record(results, "submit_enqueue_x200", order_rows, seconds, peak, len(orders))
+            _, seconds, peak = measure(lambda: [queue.flush() for _ in range(len(orders) // queue.batch_size)])
+            record(results, "outbox_flush_x200", order_rows, seconds, peak, len(orders))
+
+
+def compare(results, threshold):
+    """ Flag scenarios slower than in the previous saved run """
+    previous_files = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+    if not previous_files:
+        return []
+    with open(previous_files[-1]) as file:
+        previous = {(row["scenario"], row["size"]): row for row in json.load(file)["results"]}
+    regressions = []
+    for row in results:
+        before = previous.get((row["scenario"], row["size"]))
+        if before and before["seconds"] and row["seconds"] > before["seconds"] * (1 + threshold):
+            regressions.append(f"{row['scenario']} @ {row['size']}: {before['seconds']}s -> {row['seconds']}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="run the large sizes")
+    parser.add_argument("--only", choices=["catalog", "orders"], help="run one group of scenarios")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds added to every fake Shopify call")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="seconds added to every fake Sheets call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of Shopify calls answered with 429")
+    parser.add_argument("--bucket-size", type=int, default=4000, help="Shopify call limit of the fake store")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown flagged as a regression")
+    parser.add_argument("--no-save", action="store_true", help="do not store this run")
+    args = parser.parse_args()
+
+    sizes = FULL if args.full else QUICK
+    results = []
+    if args.only in (None, "catalog"):
+        bench_catalog_fetch(results, sizes, args.latency, args.throttle_rate, args.bucket_size)
+    if args.only in (None, "orders"):
+        bench_orders(results, sizes, args.sheets_latency)
+
+    regressions = compare(results, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        with open(os.path.join(RESULTS_DIR, f"{stamp}.json"), "w") as file:
+            json.dump({"created_at": stamp, "args": vars(args), "results": results}, file, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,48 @@
+import os
+import time
+import streamlit_authenticator as stauth
+from utils.authentication import CredentialStore
+
+CONFIG = """credentials:
+  usernames:
+    peach:
+      email:
+      name: peach
+      password: plaintext123 # hashed automatically
+cookie:
+  expiry_days: 1
+  key: test
+  name: test
+"""
+
+
+def test_hashes_are_saved_next_to_the_config_without_rewriting_it(tmp_path):
+    path = os.path.join(tmp_path, "config.yaml")
+    with open(path, "w") as file:
+        file.write(CONFIG)
+    store = CredentialStore(path)
+
+    config, version = store.load()
+    assert stauth.Hasher.is_hash(config["credentials"]["usernames"]["peach"]["password"])
+    with open(path) as file:
+        assert file.read() == CONFIG
+    assert os.path.exists(os.path.join(tmp_path, "config.hashed.yaml"))
+
+    # a new process reads the saved hashes instead of hashing again
+    assert CredentialStore(path).load() == (config, version)
+
+
+def test_editing_the_config_hashes_it_again(tmp_path):
+    path = os.path.join(tmp_path, "config.yaml")
+    with open(path, "w") as file:
+        file.write(CONFIG)
+    store = CredentialStore(path)
+    _, version = store.load()
+
+    time.sleep(0.01)
+    with open(path, "w") as file:
+        file.write(CONFIG.replace("name: peach", "name: lily"))
+    config, new_version = store.load()
+    assert new_version != version
+    assert config["credentials"]["usernames"]["peach"]["name"] == "lily"
+    assert stauth.Hasher.is_hash(config["credentials"]["usernames"]["peach"]["password"])
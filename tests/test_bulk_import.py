@@ -0,0 +1,113 @@
+import io
+import os
+from datetime import date
+import pandas as pd
+import pytest
+from api.catalog_index import CatalogIndex
+from app.bulk_import import BulkOrderImporter, CSV_COLUMNS
+from app.order_numbers import OrderNumberAllocator
+
+# 10% of the stock may be ordered, so up to 999 units of a sku
+CATALOG = pd.DataFrame({"child_sku": ["GSS-30", "GSS-50", "SUN-50"],
+                        "parent_title": ["Glass Skin Serum", "Glass Skin Serum", "Sunscreen"],
+                        "child_inventory_quantity": [10000, 10000, 100],
+                        "parent_tags": ["Marketing, Skincare", "Marketing, Skincare", "Skincare"],
+                        "parent_status": ["active", "active", "active"]})
+
+ADDRESS = {"customer_name": "Ada Lovelace", "address_1": "1 Main St", "city": "Springfield", "state": "IL",
+           "zip_code": "06201", "email": "ada@example.com", "priority": "Normal"}
+
+
+@pytest.fixture
+def importer(tmp_path):
+    order_numbers = OrderNumberAllocator(path=os.path.join(tmp_path, "numbers.sqlite3"))
+    return BulkOrderImporter(CatalogIndex(CATALOG), order_numbers, google_sheets=None, order_queue=None)
+
+
+def read(importer, *rows):
+    """ Lines as read from a CSV, every row a valid line unless overridden """
+    frame = pd.DataFrame([{"order_ref": "A", "department": "Operations", **ADDRESS, "product": "Glass Skin Serum",
+                           "sku": "GSS-30", "quantity": "1", **row} for row in rows])
+    return importer.read_csv(io.StringIO(frame.to_csv(index=False)))
+
+
+def problems(importer, *rows):
+    return importer.validate(read(importer, *rows))["problem"].tolist()
+
+
+def test_valid_lines_have_no_problems(importer):
+    assert problems(importer, {}, {"sku": "GSS-50"}, {"order_ref": "B", "ship_by": "2024-03-04"}) == []
+
+
+def test_read_csv_fills_missing_columns_and_keeps_zip_codes(importer):
+    lines = importer.read_csv(io.StringIO("Order_Ref, SKU ,zip_code\nA,GSS-30,06201\n"))
+
+    assert list(lines.columns) == CSV_COLUMNS
+    assert lines.loc[0, ["order_ref", "sku", "zip_code", "company"]].tolist() == ["A", "GSS-30", "06201", ""]
+
+
+@pytest.mark.parametrize("row, problem", [
+    ({"email": ""}, "email is required"),
+    ({"state": "Illinois"}, "state must be abbreviated"),
+    ({"department": "Legal"}, "unknown department"),
+    ({"quantity": "0"}, "quantity must be a whole positive number"),
+    ({"quantity": "two"}, "quantity must be a whole positive number"),
+    ({"sku": "NOPE-1"}, "sku not in catalog"),
+    ({"sku": "SUN-50"}, "sku does not belong to product"),
+    ({"department": "Marketing", "product": "Sunscreen", "sku": "SUN-50"}, "product not available to department"),
+    ({"product": "Sunscreen", "sku": "SUN-50", "quantity": "10"}, "not enough stock"),
+])
+def test_validate_flags_each_rule(importer, row, problem):
+    assert problems(importer, row) == [problem]
+
+
+@pytest.mark.parametrize("quantity", ["2.5", "1e1", "-3", "3.0"])
+def test_validate_rejects_quantities_that_are_not_whole_numbers(importer, quantity):
+    assert problems(importer, {"quantity": quantity}) == ["quantity must be a whole positive number"]
+
+
+def test_validate_parses_every_ship_by_with_the_same_format(importer):
+    # each line is its own order, mixed formats must not depend on which line comes first
+    lines = read(importer, {"order_ref": "A", "ship_by": "2024-03-04"}, {"order_ref": "B", "ship_by": "03/04/2024"},
+                 {"order_ref": "C", "ship_by": "2024-12-31"})
+
+    assert importer.validate(lines)[["line", "problem"]].values.tolist() == [[3, "ship_by is not a YYYY-MM-DD date"]]
+
+
+def test_validate_flags_orders_whose_lines_disagree(importer):
+    lines = read(importer, {}, {"sku": "GSS-50", "city": "Shelbyville"}, {"order_ref": "B"})
+
+    assert importer.validate(lines)[["line", "order_ref"]].values.tolist() == [[2, "A"], [3, "A"]]
+    assert set(importer.validate(lines)["problem"]) == {"order fields differ between lines of this order"}
+
+
+def test_validate_sums_stock_across_the_file(importer):
+    # 6 units each are within 10% of the stock of 100, 12 together are not
+    lines = read(importer, {"product": "Sunscreen", "sku": "SUN-50", "quantity": "6"},
+                 {"order_ref": "B", "product": "Sunscreen", "sku": "SUN-50", "quantity": "6"})
+
+    assert importer.validate(lines)["problem"].tolist() == ["not enough stock", "not enough stock"]
+
+
+def test_build_orders_numbers_each_order_per_department(importer):
+    today = date.today().strftime("%m%d%y")
+    lines = read(importer, {}, {"sku": "GSS-50"}, {"order_ref": "B", "department": "Sales"},
+                 {"order_ref": "C", "ship_by": "2024-03-04"})
+
+    rows = importer.build_orders(lines)
+
+    # lines of one order share its number, orders of a department take consecutive ones
+    assert rows["Sales order number *"].tolist() == [f"OPS{today}1", f"OPS{today}1", f"SLS{today}1",
+                                                     f"OPS{today}2"]
+    assert rows["Ship by"].tolist() == [date.today().strftime("%m/%d/%y")] * 3 + ["03/04/24"]
+    assert rows["Quantity ordered *"].tolist() == [1, 1, 1, 1]
+
+
+def test_build_orders_picks_the_channel_from_the_order_total(importer):
+    lines = read(importer, {"quantity": "60"}, {"sku": "GSS-50", "quantity": "40"},
+                 {"order_ref": "B", "quantity": "99"})
+
+    rows = importer.build_orders(lines)
+
+    # 100 units across the lines of an order make it B2B
+    assert rows["Channel *"].tolist() == ["Influencer B2B", "Influencer B2B", "Influencer D2C"]
@@ -0,0 +1,49 @@
+import json
+import os
+import time
+from api.catalog_cache import CatalogCache
+from api.shopify_api import ShopifyAPI, compact_catalog
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "webhooks")
+
+
+class RecordingShopify:
+    """ Stands in for ShopifyAPI, records the updated_at_min of every product fetch """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.calls = []
+
+    def get_product_list(self, updated_at_min=None):
+        self.calls.append(updated_at_min)
+        # nothing changed since any watermark
+        return self.catalog.iloc[:0] if updated_at_min else self.catalog
+
+
+def make_catalog():
+    with open(os.path.join(FIXTURES, "products.json")) as file:
+        products = json.load(file)["products"]
+    return compact_catalog(ShopifyAPI(access_token="test").parse_page(products))
+
+
+def test_warm_start_serves_snapshot_and_revalidates_immediately(tmp_path):
+    snapshot_path = str(tmp_path / "catalog.parquet")
+    catalog = make_catalog()
+    CatalogCache(RecordingShopify(catalog), ttl=3600, snapshot_path=snapshot_path).refresh(full=True)
+
+    shopify = RecordingShopify(catalog)
+    cache = CatalogCache(shopify, ttl=3600, snapshot_path=snapshot_path)
+    assert cache.load_snapshot()
+    # however short the host's uptime, a catalog from an earlier process is not fresh
+    assert cache.is_stale()
+
+    assert len(cache.get()) == len(catalog)
+    deadline = time.monotonic() + 5
+    while not shopify.calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # the snapshot is the base, so the revalidation only pulls products changed since it was taken
+    assert len(shopify.calls) == 1 and shopify.calls[0] is not None
+    deadline = time.monotonic() + 5
+    while cache.is_stale() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not cache.is_stale()
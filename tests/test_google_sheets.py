@@ -0,0 +1,44 @@
+import pandas as pd
+from api.google_sheets import GoogleSheets
+from app.order_format import ORDER_COLUMNS
+from benchmarks.fake_gsheets import FakeGSheetsConnection, make_order, make_order_rows
+
+
+def test_cold_read_fetches_the_whole_column_once():
+    conn = FakeGSheetsConnection(make_order_rows(20))
+    google_sheets = GoogleSheets(conn=conn)
+
+    numbers = google_sheets.read_order_numbers()
+    expected = [row[ORDER_COLUMNS.index("Sales order number *")] for row in conn.worksheet.rows[1:]]
+    assert numbers == expected
+    assert conn.worksheet.calls == {"row_values": 1, "col_values": 1}
+
+
+def test_read_after_append_only_fetches_new_rows():
+    conn = FakeGSheetsConnection(make_order_rows(20))
+    google_sheets = GoogleSheets(conn=conn)
+    before = google_sheets.read_order_numbers()
+
+    google_sheets.append_rows("Sheet1", make_order("MKT0101249999"))
+    ranges = []
+    get = conn.worksheet.get
+    conn.worksheet.get = lambda range_name: ranges.append(range_name) or get(range_name)
+
+    assert google_sheets.read_order_numbers() == before + ["MKT0101249999"]
+    assert conn.worksheet.calls["get"] == 1
+    assert conn.worksheet.calls["col_values"] == 1
+    # the ranged read starts below the rows already cached, header is row 1
+    assert ranges == [f"B{len(before) + 2}:B"]
+    assert google_sheets.read_order_numbers() == before + ["MKT0101249999"]
+    assert conn.worksheet.calls["get"] == 2
+
+
+def test_update_data_resets_the_cached_column():
+    conn = FakeGSheetsConnection(make_order_rows(20))
+    google_sheets = GoogleSheets(conn=conn)
+    google_sheets.read_order_numbers()
+
+    google_sheets.update_data("Sheet1", pd.concat([make_order("OPS0101241"), make_order("OPS0101242")]))
+    assert google_sheets.read_order_numbers() == ["OPS0101241", "OPS0101242"]
+    assert conn.worksheet.calls["col_values"] == 2
+    assert "get" not in conn.worksheet.calls
@@ -0,0 +1,73 @@
+import os
+import threading
+from utils.metrics import Metrics
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+    metrics.inc("requests_total", status=200)
+    metrics.observe("request_seconds", 0.2)
+    with metrics.span("phase_seconds", phase="login"):
+        pass
+    assert metrics.series() == []
+    assert metrics.render() == "\n"
+
+
+def test_label_values_of_any_type_render_and_sort():
+    metrics = Metrics(enabled=True)
+    metrics.inc("shopify_webhooks_total", topic="products/update", status=200)
+    # a webhook without a topic header must not break every later scrape
+    metrics.inc("shopify_webhooks_total", topic=None, status=401)
+    metrics.inc("shopify_webhooks_total", topic=5, status=401)
+
+    text = metrics.render()
+    assert 'shopify_webhooks_total{status="401",topic="None"} 1' in text
+    assert 'shopify_webhooks_total{status="200",topic="products/update"} 1' in text
+    assert len(metrics.series()) == 3
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics(enabled=True)
+    metrics.inc("shopify_webhooks_total", topic='bad"topic\\\nx')
+    assert 'shopify_webhooks_total{topic="bad\\"topic\\\\\\nx"} 1' in metrics.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics(enabled=True)
+    timings = []
+    for seconds in (0.001, 0.2, 0.2, 100):
+        metrics.observe("request_seconds", seconds, call="get")
+    with metrics.span("phase_seconds", timings, phase="login"):
+        pass
+
+    lines = metrics.render().splitlines()
+    assert 'request_seconds_bucket{call="get",le="0.005"} 1' in lines
+    assert 'request_seconds_bucket{call="get",le="0.25"} 3' in lines
+    assert 'request_seconds_bucket{call="get",le="+Inf"} 4' in lines
+    assert 'request_seconds_count{call="get"} 4' in lines
+    assert [(name, labels) for name, labels, _ in timings] == [("phase_seconds", {"phase": "login"})]
+
+
+def test_concurrent_writes_to_one_file(tmp_path):
+    metrics = Metrics(enabled=True)
+    metrics.inc("order_submissions_total")
+    path = str(tmp_path / "order_app.prom")
+    errors = []
+
+    def write():
+        try:
+            for _ in range(50):
+                metrics.write(path)
+        except Exception as e:
+            errors.append(e)
+
+    # every script run writes the file when it ends, several sessions can finish at once
+    writers = [threading.Thread(target=write) for _ in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    assert errors == []
+    assert open(path).read() == metrics.render()
+    assert os.listdir(tmp_path) == ["order_app.prom"]
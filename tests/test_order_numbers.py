@@ -0,0 +1,39 @@
+import os
+import time
+from datetime import date
+from app.order_numbers import OrderNumberAllocator
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_seed_raises_counters_to_numbers_on_the_sheet(tmp_path):
+    allocator = OrderNumberAllocator(path=os.path.join(tmp_path, "numbers.sqlite3"))
+    allocator.seed(["MKT01012412", "MKT0101243", "SLS0101241", "not a number"])
+
+    assert allocator.is_seeded()
+    assert allocator.allocate("Marketing", order_date=date(2024, 1, 1)) == "MKT01012413"
+    assert allocator.allocate_many("Sales", 2, order_date=date(2024, 1, 1)) == ["SLS0101242", "SLS0101243"]
+
+
+def test_seed_in_background_retries_until_the_sheet_can_be_read(tmp_path):
+    allocator = OrderNumberAllocator(path=os.path.join(tmp_path, "numbers.sqlite3"))
+    reads = []
+
+    def read_order_numbers():
+        reads.append(1)
+        if len(reads) == 1:
+            raise ConnectionError("sheets is down")
+        return ["OPS0101245"]
+
+    allocator.seed_in_background(read_order_numbers)
+    assert wait_for(lambda: allocator.seed_error is not None)
+    assert not allocator.is_seeded()
+
+    # the error is cleared right after the seed commits
+    assert wait_for(lambda: allocator.is_seeded() and allocator.seed_error is None)
+    assert allocator.allocate("Operations", order_date=date(2024, 1, 1)) == "OPS0101246"
@@ -0,0 +1,114 @@
+import os
+from types import SimpleNamespace
+import pytest
+from api.google_sheets import GoogleSheets
+from app.order_format import ORDER_COLUMNS
+from app.order_queue import OrderQueue
+from benchmarks.fake_gsheets import FakeGSheetsConnection, make_order
+
+
+def sheet_order_numbers(conn):
+    return [row[ORDER_COLUMNS.index("Sales order number *")] for row in conn.worksheet.rows[1:]]
+
+
+@pytest.fixture
+def sheets(tmp_path):
+    conn = FakeGSheetsConnection()
+    return conn, OrderQueue(GoogleSheets(conn=conn), path=os.path.join(tmp_path, "outbox.sqlite3"))
+
+
+def test_flush_appends_pending_orders_once(sheets):
+    conn, queue = sheets
+    assert queue.enqueue("MKT0101241", make_order("MKT0101241", lines=2))
+    assert not queue.enqueue("MKT0101241", make_order("MKT0101241", lines=2))
+
+    assert queue.flush() == 1
+    assert queue.flush() == 0
+    assert sheet_order_numbers(conn) == ["MKT0101241", "MKT0101241"]
+    # a first attempt has nothing to look up on the sheet
+    assert "col_values" not in conn.worksheet.calls
+
+
+def test_append_that_reached_the_sheet_is_not_written_again(sheets):
+    conn, queue = sheets
+    queue.enqueue("MKT0101241", make_order("MKT0101241", lines=2))
+    append_rows = queue.google_sheets.append_rows
+
+    def append_then_time_out(worksheet, data):
+        append_rows(worksheet, data)
+        raise TimeoutError("sheets did not answer")
+
+    queue.google_sheets.append_rows = append_then_time_out
+    with pytest.raises(TimeoutError):
+        queue.flush()
+    queue.google_sheets.append_rows = append_rows
+
+    assert queue.flush() == 1
+    assert sheet_order_numbers(conn) == ["MKT0101241", "MKT0101241"]
+    assert queue.depth() == 0
+
+
+def test_orders_queued_after_a_failed_append_are_checked_first(sheets):
+    conn, queue = sheets
+    # a bulk append that timed out after reaching the sheet
+    queue.google_sheets.append_rows("Sheet1", make_order("SLS0101241", lines=2))
+    queue.enqueue("SLS0101241", make_order("SLS0101241", lines=2), attempts=1)
+    queue.enqueue("SLS0101242", make_order("SLS0101242", lines=2), attempts=1)
+
+    # orders already tried go one at a time
+    assert [queue.flush() for _ in range(3)] == [1, 1, 0]
+    assert sheet_order_numbers(conn) == ["SLS0101241"] * 2 + ["SLS0101242"] * 2
+
+
+
+class Rejected(Exception):
+    """ Sheets refusing the request, like gspread's APIError on a 400 """
+    response = SimpleNamespace(status_code=400)
+
+
+def test_order_sheets_keeps_rejecting_is_marked_failed_and_does_not_block_the_queue(sheets):
+    conn, queue = sheets
+    for number in ("MKT0101241", "MKT0101242", "MKT0101243"):
+        queue.enqueue(number, make_order(number, lines=2))
+    append_rows = queue.google_sheets.append_rows
+
+    def reject_bad_order(worksheet, data):
+        if "MKT0101241" in set(data["Sales order number *"]):
+            raise Rejected("invalid value at row 1")
+        append_rows(worksheet, data)
+
+    queue.google_sheets.append_rows = reject_bad_order
+    # the whole batch fails first, then the oldest order is retried alone until it is given up on
+    for _ in range(queue.max_attempts - 1):
+        with pytest.raises(Rejected):
+            queue.flush()
+    assert queue.flush() == 1
+    assert queue.failed() == ["MKT0101241"]
+
+    assert [queue.flush() for _ in range(3)] == [1, 1, 0]
+    assert sheet_order_numbers(conn) == ["MKT0101242"] * 2 + ["MKT0101243"] * 2
+    assert queue.stats()["failed"] == 1
+    assert queue.stats()["depth"] == 0
+
+    queue.google_sheets.append_rows = append_rows
+    assert queue.retry_failed() == 1
+    assert queue.flush() == 1
+    assert queue.failed() == []
+    assert sheet_order_numbers(conn)[-2:] == ["MKT0101241"] * 2
+
+
+def test_outage_is_retried_without_failing_orders(sheets):
+    _, queue = sheets
+    queue.enqueue("MKT0101241", make_order("MKT0101241", lines=2))
+    append_rows = queue.google_sheets.append_rows
+
+    def sheets_down(worksheet, data):
+        raise ConnectionError("sheets is down")
+
+    queue.google_sheets.append_rows = sheets_down
+    for _ in range(queue.max_attempts + 2):
+        with pytest.raises(ConnectionError):
+            queue.flush()
+    assert queue.failed() == []
+    queue.google_sheets.append_rows = append_rows
+    assert queue.flush() == 1
@@ -0,0 +1,47 @@
+import os
+from api.rate_limiter import LeakyBucket
+from api.shopify_api import ShopifyAPI
+from benchmarks.fake_shopify import FakeShopify, make_catalog
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def make_api(**options):
+    return ShopifyAPI(access_token="test", rate_limiter=LeakyBucket(capacity=4000, leak_rate=200), **options)
+
+
+def test_parse_bulk_lines_rebuilds_variants_from_parent_ids():
+    with open(os.path.join(FIXTURES, "bulk_products.jsonl")) as file:
+        catalog = make_api().parse_bulk_lines(line.rstrip("\n") for line in file)
+
+    assert list(catalog["child_id"]) == [1001, 1002, 1003]
+    assert list(catalog["parent_id"]) == [101, 101, 102]
+    assert list(catalog["parent_title"]) == ["Glass Skin Serum", "Glass Skin Serum", "Sunscreen"]
+    assert list(catalog["parent_status"]) == ["active", "active", "draft"]
+    # graphql tags are a list, the catalog keeps rest's comma separated string
+    assert list(catalog["parent_tags"]) == ["Marketing, Skincare", "Marketing, Skincare", ""]
+    # null inventoryQuantity counts as no stock instead of failing the whole fetch
+    assert list(catalog["child_inventory_quantity"]) == [120, 0, 7]
+    assert catalog["child_inventory_item_id"].tolist()[:2] == [5001, 5002]
+    assert catalog["child_inventory_item_id"].isna().tolist()[2]
+
+
+def test_parse_bulk_lines_without_lines():
+    assert make_api().parse_bulk_lines([]).empty
+
+
+def test_bulk_fetch_against_fake_server():
+    products = make_catalog(120, variants_per_product=4)
+    fake = FakeShopify(products, bucket_size=4000, leak_rate=200).start()
+    try:
+        shopify_api = make_api(base_url=fake.url, catalog_source="bulk")
+        shopify_api.BULK_POLL_INTERVAL = 0.01
+        catalog = shopify_api.get_product_list()
+    finally:
+        fake.stop()
+
+    assert len(catalog) == 120
+    assert fake.requests["/bulk/result.jsonl"] == 1
+    first = catalog.iloc[0]
+    assert (first["child_sku"], first["parent_id"], first["parent_tags"]) == \
+        (products[0]["variants"][0]["sku"], products[0]["id"], products[0]["tags"])
@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import pytest
+from api.catalog_cache import CatalogCache
+from api.shopify_api import ShopifyAPI, compact_catalog
+from api.webhooks import WebhookReceiver
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "webhooks")
+SECRET = "test-webhook-secret"
+
+
+def recorded(name):
+    """ Raw body of a recorded webhook, replayed byte for byte """
+    with open(os.path.join(FIXTURES, name), "rb") as file:
+        return file.read()
+
+
+def sign(body, secret=SECRET):
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+@pytest.fixture
+def receiver():
+    shopify_api = ShopifyAPI(access_token="test")
+    cache = CatalogCache(shopify_api, ttl=3600, snapshot_path=None)
+    cache.data = compact_catalog(shopify_api.parse_page(json.loads(recorded("products.json"))["products"]))
+    cache.version = 1
+    # fresh, so reading the index never starts the background refresher
+    cache._fetched_at = time.monotonic()
+    cache.index()
+    return WebhookReceiver(cache, SECRET)
+
+
+def stock(cache, sku):
+    return int(cache.data.loc[cache.data["child_sku"] == sku, "child_inventory_quantity"].iloc[0])
+
+
+def test_inventory_level_update_applies_deltas_per_location(receiver):
+    cache = receiver.catalog_cache
+    body = recorded("inventory_levels_update.json")
+
+    # the first level of a location is only the baseline, the catalog holds the total of all locations
+    assert receiver.handle("inventory_levels/update", body, sign(body)) == 200
+    assert stock(cache, "GSS-30") == 120
+
+    level = dict(json.loads(body), available=35)
+    body = json.dumps(level).encode()
+    assert receiver.handle("inventory_levels/update", body, sign(body)) == 200
+    assert stock(cache, "GSS-30") == 115
+    assert cache.index().stock("GSS-30") == 115
+    assert cache.version == 1
+    assert receiver.received == {"inventory_levels/update": 2}
+
+
+def test_bad_signature_is_rejected(receiver):
+    body = recorded("inventory_levels_update.json")
+    assert receiver.handle("inventory_levels/update", body, sign(body, secret="wrong")) == 401
+    assert receiver.handle("inventory_levels/update", body, None) == 401
+    assert receiver.received == {}
+    assert receiver.catalog_cache._levels == {}
+
+
+def test_unknown_inventory_item_leaves_catalog_alone(receiver):
+    cache = receiver.catalog_cache
+    before = cache.data.copy()
+    body = recorded("inventory_levels_update_unknown.json")
+
+    assert receiver.handle("inventory_levels/update", body, sign(body)) == 200
+    assert cache.data.equals(before)
+    assert cache.version == 1
+
+
+def test_stock_only_product_update_keeps_version(receiver):
+    cache = receiver.catalog_cache
+    index = cache.index()
+    body = recorded("products_update_stock.json")
+
+    assert receiver.handle("products/update", body, sign(body)) == 200
+    assert (stock(cache, "GSS-30"), stock(cache, "GSS-50"), stock(cache, "SUN-50")) == (90, 55, 15)
+    assert cache.version == 1
+    # stock changes are written into the current index instead of rebuilding it
+    assert cache.index() is index
+    assert index.stock("GSS-30") == 90
+
+
+def test_title_change_replaces_rows_and_bumps_version(receiver):
+    cache = receiver.catalog_cache
+    body = recorded("products_update_title.json")
+
+    assert receiver.handle("products/update", body, sign(body)) == 200
+    assert cache.version == 2
+    assert len(cache.data) == 3
+    assert set(cache.data.loc[cache.data["parent_id"] == 7001, "parent_title"]) == {"Glass Skin Refining Serum"}
+    index = cache.index()
+    assert "Glass Skin Refining Serum" in index.titles
+    assert "Glass Skin Serum" not in index.titles
+    assert index.skus_for("Glass Skin Refining Serum") == ("GSS-30", "GSS-50")
@@ -1,42 +1,121 @@
+import copy
+import os
+import threading
 import streamlit_authenticator as stauth
 import yaml
 from yaml.loader import SafeLoader
 import streamlit as st
-    
+from utils.metrics import metrics
+
+
+class CredentialStore:
+    """ Process-wide copy of the login configuration with every password already hashed.
+    Plaintext passwords are bcrypt-hashed once and the hashed configuration is saved to a separate,
+    git-ignored file next to the config, so config.yaml and its comments are never rewritten.
+    The hashed file is used while it is newer than the config, and files are only read again when
+    their modification time changes.
+
+    :param path: path of the yaml configuration file
+    :param hashed_path: file the hashed configuration is saved to, <config name>.hashed.yaml by default
+
+    :ivar path: path of the yaml configuration file
+    :ivar hashed_path: file the hashed configuration is saved to
+    """
+    def __init__(self, path="config.yaml", hashed_path=None):
+        self.path = path
+        self.hashed_path = hashed_path or os.path.splitext(path)[0] + ".hashed.yaml"
+        self._config = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ Return the hashed configuration and the file version it was read from
+        """
+        source, version = self.path, os.stat(self.path).st_mtime_ns
+        try:
+            hashed_version = os.stat(self.hashed_path).st_mtime_ns
+        except FileNotFoundError:
+            hashed_version = None
+        # hashes saved after the last edit of the config are still current
+        if hashed_version is not None and hashed_version >= version:
+            source, version = self.hashed_path, hashed_version
+        with self._lock:
+            if version != self._version:
+                with open(source) as file:
+                    config = yaml.load(file, Loader=SafeLoader)
+                passwords = [user["password"] for user in config["credentials"]["usernames"].values()]
+                if not all(stauth.Hasher.is_hash(str(password)) for password in passwords):
+                    stauth.Hasher.hash_passwords(config["credentials"])
+                    version = self.save(config) or version
+                self._config = config
+                self._version = version
+            return self._config, self._version
+
+    def save(self, config):
+        """ Save the hashed configuration so later processes skip hashing.
+        Returns the new file version, or None when it cannot be written and hashes stay in memory.
+        :param config: configuration with hashed passwords
+        """
+        try:
+            with open(self.hashed_path, "w") as file:
+                yaml.dump(config, file, default_flow_style=False, sort_keys=False)
+        except OSError as e:
+            print(f"could not save hashed passwords to {self.hashed_path}: {e}")
+            return None
+        return os.stat(self.hashed_path).st_mtime_ns
+
+
+# one store per process, shared by every session
+credential_store = CredentialStore()
+
+
 class Authenticator:
-    """ Login Authenticator for the streamlit app when accessing
-    
+    """ Login Authenticator for the streamlit app when accessing.
+    The streamlit authenticator is built once per session from pre-hashed credentials
+    and rebuilt only when config.yaml changes.
+
     :ivar config: load login and password configuration from yaml file
     :ivar authenticator: layout configuration and use for login
     """
-    
+
     def __init__(self):
-        self.config = self.load_config()
-        self.authenticator = stauth.Authenticate(
-           self.config['credentials'],
-           self.config['cookie']['name'],
-           self.config['cookie']['key'],
-           self.config['cookie']['expiry_days'],
-        )
-        
+        self.config, version = credential_store.load()
+        cached = st.session_state.get("_authenticator")
+        if cached is not None and cached[0] == version:
+            metrics.inc("cache_requests_total", cache="authenticator", result="hit")
+            self.authenticator = cached[1]
+        else:
+            metrics.inc("cache_requests_total", cache="authenticator", result="miss")
+            self.authenticator = stauth.Authenticate(
+               # authenticator updates login state in the credentials, keep the shared copy untouched
+               copy.deepcopy(self.config['credentials']),
+               self.config['cookie']['name'],
+               self.config['cookie']['key'],
+               self.config['cookie']['expiry_days'],
+               auto_hash=False,
+            )
+            st.session_state["_authenticator"] = (version, self.authenticator)
+
     def load_config(self):
-        """ Load configuration from yaml file
+        """ Load configuration from yaml file, cached until the file changes
         """
-        with open('config.yaml') as file:
-            config = yaml.load(file, Loader=SafeLoader)
-            return config
-    
+        config, _ = credential_store.load()
+        return config
+
     def login(self):
         """ Use authenticator and login app to main page
         """
+        # already verified in this session, nothing to check again
+        if st.session_state.get("authentication_status"):
+            return
         self.authenticator.login(location="main")
-        
+
     def logout(self, button_name="Logout", location="main"):
         """ Use authenticator to logout of app
         :param button_name: Button of logout name will be 'Logout'
         :param location: Logout location will be main
         """
         self.authenticator.logout(button_name=button_name, location=location)
-        
+
     def authentication_status(self):
-        return st.session_state["authentication_status"]
\ No newline at end of file
+        return st.session_state.get("authentication_status")
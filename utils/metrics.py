@@ -0,0 +1,294 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import streamlit as st
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# returned by span while disabled, entering and leaving it does nothing
+_NO_SPAN = nullcontext()
+
+
+class Metrics:
+    """ Process-wide counters, gauges and latency histograms for the order app's hot paths.
+    Off by default; while off every call returns before touching any state, so instrumented code
+    only pays for one attribute check. Measurements are rendered in the Prometheus text format,
+    served over http and/or written to a file.
+
+    :param enabled: whether measurements are recorded
+
+    :ivar enabled: whether measurements are recorded
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def inc(self, name, value=1, **labels):
+        """ Add to a counter
+        :param name: metric name, ending in _total
+        :param value: amount to add
+        :param labels: label values of the series
+        """
+        if not self.enabled:
+            return
+        key = series_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """ Set a gauge
+        :param name: metric name
+        :param value: current value
+        :param labels: label values of the series
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[series_key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        """ Record one duration in a latency histogram
+        :param name: metric name, ending in _seconds
+        :param seconds: measured duration
+        :param labels: label values of the series
+        """
+        if not self.enabled:
+            return
+        key = series_key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # one count per bucket plus the overflow bucket, then the sum of all durations
+                histogram = self._histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            histogram[0][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+
+    def span(self, name, timings=None, **labels):
+        """ Context manager timing a block into a latency histogram
+        :param name: metric name, ending in _seconds
+        :param timings: list the span is also appended to as (name, labels, seconds), for per-session display
+        :param labels: label values of the series
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name, labels, timings)
+
+    def series(self):
+        """ Current value of every counter and gauge, and count and sum of every histogram, as rows
+        """
+        with self._lock:
+            rows = [{"metric": name, "labels": format_labels(labels), "value": value}
+                    for (name, labels), value in sorted({**self._counters, **self._gauges}.items())]
+            rows += [{"metric": name, "labels": format_labels(labels), "value": sum(buckets),
+                      "seconds": round(total, 4)}
+                     for (name, labels), (buckets, total) in sorted(self._histograms.items())]
+        return rows
+
+    def render(self):
+        """ Every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for kind, values in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    lines += [f"{name}{format_labels(labels)} {value}"
+                              for (series, labels), value in sorted(values.items()) if series == name]
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (series, labels), (buckets, total) in sorted(self._histograms.items()):
+                    if series != name:
+                        continue
+                    # prometheus buckets are cumulative, ours count each range once
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """ Write the rendered metrics to a file, e.g. for node_exporter's textfile collector.
+        Written next to the target and renamed over it so readers never see a partial file.
+        :param path: file to write
+        """
+        if not self.enabled:
+            return
+        # a temporary file of its own per call, concurrent script runs would otherwise rename each other's away
+        descriptor, partial = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        try:
+            # mkstemp files are private to us, the exporter may read them as another user
+            os.fchmod(descriptor, 0o644)
+            with os.fdopen(descriptor, "w") as file:
+                file.write(self.render())
+            os.replace(partial, path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+
+    def serve(self, host="0.0.0.0", port=9464):
+        """ Serve the rendered metrics on /metrics from a daemon thread
+        :param host: address to listen on
+        :param port: port to listen on
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes every few seconds would drown the app log
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        print(f"serving metrics on {host}:{port}/metrics")
+
+
+class _Span:
+    def __init__(self, metrics, name, labels, timings):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.timings = timings
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        # st.stop() ends a run with an exception, the phase still counts
+        seconds = time.perf_counter() - self.start
+        self.metrics.observe(self.name, seconds, **self.labels)
+        if self.timings is not None:
+            self.timings.append((self.name, self.labels, seconds))
+        return False
+
+
+class SamplingProfiler:
+    """ Low overhead sampling profiler for one thread.
+    A daemon thread records the target thread's stack every interval instead of tracing every call,
+    so it can stay on for a whole script run.
+
+    :param interval: seconds between samples
+
+    :ivar samples: sample count per collapsed stack ('file:function;file:function'), the format flame graph tools read
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = None
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def start(self, thread_id=None):
+        """ Start sampling
+        :param thread_id: thread to sample, the calling thread by default
+        """
+        self._thread_id = thread_id or threading.get_ident()
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        """ Stop sampling and wait for the sampler thread
+        """
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def top(self, limit=20):
+        """ Functions on the stack in the most samples, with their share of all samples
+        :param limit: how many functions to return
+        """
+        total = sum(self.samples.values())
+        functions = Counter()
+        for stack, count in self.samples.items():
+            # recursion would count a function more than once per sample
+            for function in set(stack.split(";")):
+                functions[function] += count
+        return [(function, count / total) for function, count in functions.most_common(limit)]
+
+    def write(self, path):
+        """ Write the collapsed stacks, one 'stack count' line each
+        :param path: file to write
+        """
+        with open(path, "w") as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def series_key(name, labels):
+    """ Key of one series. Label values are kept as strings so keys always sort, whatever the caller passed.
+    :param name: metric name
+    :param labels: label values of the series
+    """
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def format_labels(labels):
+    """ Render label pairs as {name="value",...}, empty when there are none
+    :param labels: tuple of (name, value) pairs
+    """
+    if not labels:
+        return ""
+    # backslashes, quotes and newlines would end the value early in the exposition format
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+# one registry per process, shared by every session and background thread
+metrics = Metrics()
+
+
+@st.cache_resource
+def get_metrics(enabled=False, port=0):
+    """ Process-wide Metrics, switched on and served once from the order app settings
+    :param enabled: whether measurements are recorded
+    :param port: port serving /metrics, 0 disables the endpoint
+    """
+    metrics.enabled = enabled
+    if enabled and port:
+        metrics.serve(port=port)
+    return metrics
\ No newline at end of file
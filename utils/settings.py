@@ -0,0 +1,60 @@
+import os
+import threading
+import yaml
+from yaml.loader import SafeLoader
+
+# Defaults used when config.yaml has no `order_app` section or a key is missing
+DEFAULT_SETTINGS = {
+    # seconds before the shared product catalog is refreshed from Shopify
+    "catalog_ttl_seconds": 300,
+    # 'rest' pages products.json, 'bulk' exports the catalog with a GraphQL bulk operation
+    "catalog_source": "rest",
+    # request only the product fields the app uses and keep them with compact dtypes
+    "catalog_lean": True,
+    # created_at partitions fetched in parallel on a full catalog load, 1 pages serially
+    "catalog_concurrency": 1,
+    # parquet snapshot of the catalog loaded at startup, empty to disable
+    "catalog_snapshot_path": "catalog_snapshot.parquet",
+    # port of the shopify webhook receiver, 0 disables it
+    "webhook_port": 0,
+    # sqlite file holding submitted orders until they are written to google sheets
+    "outbox_path": "order_outbox.sqlite3",
+    # sqlite file holding the per-department, per-day sales order counters
+    "order_numbers_path": "order_numbers.sqlite3",
+    # record request latencies, cache hits and run phase timings, off keeps instrumentation to a flag check
+    "metrics_enabled": False,
+    # port serving the metrics in prometheus text format on /metrics, 0 disables it
+    "metrics_port": 0,
+    # file the metrics are written to after every run, empty to disable
+    "metrics_path": "",
+    # sample the script thread during every run and show the hottest functions in the debug panel
+    "profiler": False,
+    # file the collapsed stacks of the last profiled run are written to, empty to disable
+    "profile_path": "",
+}
+
+
+# path -> (modification time, settings), so reruns only parse the file again after it changes
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load_settings(path="config.yaml"):
+    """ Load order app settings from the `order_app` section of the yaml config.
+    The parsed settings are kept per process and only read again when the file's modification time changes.
+    :param path: path of the yaml configuration file
+    """
+    try:
+        version = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return dict(DEFAULT_SETTINGS)
+    with _lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != version:
+            settings = dict(DEFAULT_SETTINGS)
+            with open(path) as file:
+                config = yaml.load(file, Loader=SafeLoader) or {}
+            settings.update(config.get("order_app") or {})
+            cached = _loaded[path] = (version, settings)
+    # callers get their own copy so the cached settings cannot be changed by accident
+    return dict(cached[1])
\ No newline at end of file